@@ -0,0 +1,233 @@
+"""
+Load-tests the bot's handlers with synthetic users pressing buttons at once.
+
+Updates go through the real Application and handlers, backed by in-memory
+storage and a fake Bot API, and the run reports latency percentiles,
+throughput and storage call counts.
+
+    python bench_bot.py --users 300 --storage-latency 20 --api-latency 30
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import threading
+from collections import Counter
+
+# The bot creates its storage at import time, so select the backend first
+os.environ["STORAGE_BACKEND"] = "memory"
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+import telegram_bot
+from config import BRANDS, COLORS, PRICE_FROM
+
+BENCH_TOKEN = "123456:bench"
+
+
+class FakeBotAPI(BaseRequest):
+    """Answers Bot API calls locally after a fixed delay, counting each method."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = Counter()
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls[api_method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if api_method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif api_method in ("sendMessage", "editMessageText", "editMessageReplyMarkup"):
+            result = {
+                "message_id": int(params.get("message_id", 1)),
+                "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id", 1)), "type": "private"},
+                "text": params.get("text", ""),
+            }
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+class CountingStorage:
+    """Wraps a storage backend, counting calls and adding a simulated round trip."""
+
+    def __init__(self, storage, latency):
+        self.storage = storage
+        self.latency = latency
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attr = getattr(self.storage, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            with self.lock:
+                self.calls[name] += 1
+            if self.latency:
+                time.sleep(self.latency)
+            return attr(*args, **kwargs)
+        return call
+
+
+def user_session(rng):
+    """A plausible stream of button presses for one user, after /start and /dashboard."""
+    data = []
+    for _ in range(rng.randint(1, 3)):
+        field = rng.choice(["brands", "colors", "price"])
+        if field == "brands":
+            data.append("edit_brands")
+            data += [f"brand_toggle_{bid}" for bid in rng.sample(list(BRANDS.values()), rng.randint(1, 4))]
+            data.append("brand_confirm")
+        elif field == "colors":
+            data.append("edit_colors")
+            data += [f"color_toggle_{cid}" for cid in rng.sample(list(COLORS.values()), rng.randint(1, 3))]
+            data.append("color_confirm")
+        else:
+            data.append("edit_price_from")
+            data.append(f"price_{rng.choice(list(PRICE_FROM.values()))}")
+            data.append("price_confirm")
+        data.append("dashboard")
+    data.append("save_config")
+    return data
+
+
+def command_update(update_id, user_id, command):
+    text = f"/{command}"
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}],
+        },
+    }
+
+
+def callback_update(update_id, user_id, data):
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "text": "dashboard",
+            },
+        },
+    }
+
+
+def build_updates(users, seed):
+    """Interleaves every user's session so that presses from many chats arrive together."""
+    rng = random.Random(seed)
+    streams = []
+    for user_id in range(1000, 1000 + users):
+        stream = [("command", "start"), ("command", "dashboard")]
+        stream += [("callback", data) for data in user_session(rng)]
+        streams.append((user_id, stream))
+    updates = []
+    update_id = 0
+    while streams:
+        user_id, stream = rng.choice(streams)
+        kind, value = stream.pop(0)
+        update_id += 1
+        if kind == "command":
+            updates.append(command_update(update_id, user_id, value))
+        else:
+            updates.append(callback_update(update_id, user_id, value))
+        if not stream:
+            streams.remove((user_id, stream))
+    return updates
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def run(args):
+    api = FakeBotAPI(args.api_latency / 1000)
+    storage = CountingStorage(telegram_bot.storage, args.storage_latency / 1000)
+    telegram_bot.storage = storage
+    application = telegram_bot.build_application(BENCH_TOKEN, request=api)
+
+    enqueued = {}
+    handler_ms = []
+    latency_ms = []
+    done = asyncio.Event()
+    expected = 0
+
+    def timed(callback):
+        async def wrapper(update, context):
+            started = time.perf_counter()
+            try:
+                return await callback(update, context)
+            finally:
+                finished = time.perf_counter()
+                handler_ms.append((finished - started) * 1000)
+                latency_ms.append((finished - enqueued[update.update_id]) * 1000)
+                if len(latency_ms) == expected:
+                    done.set()
+        return wrapper
+
+    for handler in application.handlers[0]:
+        handler.callback = timed(handler.callback)
+
+    await application.initialize()
+    await application.start()
+    updates = [Update.de_json(data, application.bot) for data in build_updates(args.users, args.seed)]
+    expected = len(updates)
+    storage.calls.clear()
+    api.calls.clear()
+
+    started = time.perf_counter()
+    for update in updates:
+        enqueued[update.update_id] = time.perf_counter()
+        await application.update_queue.put(update)
+    await done.wait()
+    elapsed = time.perf_counter() - started
+
+    await application.stop()
+    await application.shutdown()
+
+    print(f"{expected} updates from {args.users} users in {elapsed:.2f}s ({expected / elapsed:.1f} updates/s)")
+    for label, values in (("queue-to-done", latency_ms), ("handler", handler_ms)):
+        print(
+            f"{label:>14} ms: p50 {percentile(values, 50):8.1f}  p95 {percentile(values, 95):8.1f}  "
+            f"p99 {percentile(values, 99):8.1f}  max {max(values):8.1f}"
+        )
+    print("storage calls: " + ", ".join(f"{name}={count}" for name, count in sorted(storage.calls.items())))
+    print("bot API calls: " + ", ".join(f"{name}={count}" for name, count in sorted(api.calls.items())))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=200, help="simulated users pressing buttons at once")
+    parser.add_argument("--storage-latency", type=float, default=0, help="simulated storage round trip in ms")
+    parser.add_argument("--api-latency", type=float, default=0, help="simulated Bot API round trip in ms")
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(run(parser.parse_args()))
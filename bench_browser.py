@@ -0,0 +1,135 @@
+"""
+Measures bytes and milliseconds per catalog page for the default and the
+lean browser profile, against a local static stand-in for a Vinted catalog.
+
+    python bench_browser.py --pages 5
+"""
+import os
+import time
+import argparse
+import tempfile
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from bs4 import BeautifulSoup
+
+from scraper import PRODUCT_LINK_SELECTOR, create_driver, open_catalog_page, scroll_and_settle
+
+ITEMS_PER_PAGE = 96
+IMAGE_BYTES = 40 * 1024
+FONT_BYTES = 120 * 1024
+SCRIPT_BYTES = 80 * 1024
+
+
+def build_site(root):
+    """Writes a catalog page with product links, photos, fonts and third-party scripts."""
+    os.makedirs(os.path.join(root, "img"))
+    os.makedirs(os.path.join(root, "fonts"))
+    # Third-party hosts are stood in for by path prefixes, which the blocked
+    # URL patterns match just as they would match the real domains
+    for host in ("www.googletagmanager.com", "connect.facebook.net"):
+        os.makedirs(os.path.join(root, host))
+        with open(os.path.join(root, host, "tag.js"), "w") as f:
+            f.write("// " + "x" * SCRIPT_BYTES + "\n")
+    for i in range(ITEMS_PER_PAGE):
+        with open(os.path.join(root, "img", f"{i}.jpg"), "wb") as f:
+            f.write(os.urandom(IMAGE_BYTES))
+    with open(os.path.join(root, "fonts", "site.woff2"), "wb") as f:
+        f.write(os.urandom(FONT_BYTES))
+
+    items = "\n".join(
+        f'<div class="item"><img src="/img/{i}.jpg" width="200" height="260">'
+        f'<a data-testid="product-item-id-{i}--overlay-link" href="/items/{1000 + i}-item-{i}" '
+        f'title="Item {i}"></a></div>'
+        for i in range(ITEMS_PER_PAGE)
+    )
+    page = f"""<!DOCTYPE html>
+<html><head>
+<style>@font-face {{ font-family: Site; src: url(/fonts/site.woff2); }} body {{ font-family: Site; }}</style>
+<script src="/www.googletagmanager.com/tag.js"></script>
+<script src="/connect.facebook.net/tag.js"></script>
+</head><body>
+<div id="catalog">{items}</div>
+</body></html>"""
+    with open(os.path.join(root, "catalog.html"), "w") as f:
+        f.write(page)
+
+
+class CountingHandler(SimpleHTTPRequestHandler):
+    """Serves files and counts the bytes sent per request."""
+
+    stats = {"bytes": 0, "requests": 0}
+    lock = threading.Lock()
+
+    def copyfile(self, source, outputfile):
+        data = source.read()
+        outputfile.write(data)
+        with self.lock:
+            self.stats["bytes"] += len(data)
+            self.stats["requests"] += 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+def measure(profile, url, pages):
+    """
+    Times each page up to the point the product links are present, and reads
+    the browser's load event time. The fixed post-scroll settle sleep is left
+    out of both, but its requests still count towards the bytes.
+    """
+    lean = profile == "lean"
+    driver = create_driver(lean=lean)
+    results = []
+    try:
+        for _ in range(pages):
+            # Start each page with a cold cache so every run downloads the same set
+            driver.execute_cdp_cmd("Network.clearBrowserCache", {})
+            CountingHandler.stats.update(bytes=0, requests=0)
+            started = time.perf_counter()
+            open_catalog_page(driver, url)
+            ready_ms = (time.perf_counter() - started) * 1000
+            load_ms = driver.execute_script(
+                "const nav = performance.getEntriesByType('navigation')[0];"
+                "return nav.loadEventEnd - nav.startTime;"
+            )
+            scroll_and_settle(driver)
+            links = len(BeautifulSoup(driver.page_source, "html.parser").select(PRODUCT_LINK_SELECTOR))
+            results.append({
+                "ready_ms": ready_ms,
+                "load_ms": load_ms,
+                "bytes": CountingHandler.stats["bytes"],
+                "requests": CountingHandler.stats["requests"],
+                "links": links,
+            })
+    finally:
+        driver.quit()
+    return results
+
+
+def report(profile, results):
+    def average(key):
+        return sum(r[key] for r in results) / len(results)
+    print(
+        f"{profile:>8}: links ready {average('ready_ms'):7.0f} ms  load event {average('load_ms'):7.0f} ms  "
+        f"{average('bytes') / 1024:9.1f} KiB/page  {average('requests'):6.1f} requests/page  "
+        f"{results[-1]['links']} product links"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, default=3, help="page loads per profile")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        build_site(root)
+        server = ThreadingHTTPServer(("127.0.0.1", 0), partial(CountingHandler, directory=root))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/catalog.html"
+        try:
+            for profile in ("default", "lean"):
+                report(profile, measure(profile, url, args.pages))
+        finally:
+            server.shutdown()
@@ -0,0 +1,166 @@
+"""
+Runs several scraper nodes as separate processes against one SQLite database,
+with partition leasing on and one node crashing part way through.
+
+Each node runs the real run_forever loop with scraping replaced by a stub that
+records the fetch, and all nodes share one config snapshot file while configs
+keep being edited. The run fails if a search is fetched twice in one cycle, if
+the crashed node's chats are not picked up by the surviving nodes, or if the
+shared snapshot fails to refresh or ends up unreadable.
+
+    python bench_leases.py --nodes 3 --chats 40 --seconds 30
+"""
+import os
+import sys
+import json
+import time
+import queue
+import logging
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from collections import Counter, defaultdict
+
+# Fetches are stubbed out, so the per-domain request budget only slows the run
+os.environ["DOMAIN_REQUESTS_PER_MINUTE"] = "0"
+
+import scraper
+from config_feed import ConfigSnapshot
+from leases import PartitionLeases
+from storage import SQLiteStorage
+
+
+class ErrorForwarder(logging.Handler):
+    """Sends a node's error log records to the parent through the fetch queue."""
+
+    def __init__(self, node_id, fetches):
+        super().__init__(logging.ERROR)
+        self.node_id = node_id
+        self.fetches = fetches
+
+    def emit(self, record):
+        self.fetches.put((self.node_id, None, None, record.getMessage()))
+
+
+def run_node(path, snapshot_path, node_id, args, crash_after, fetches):
+    storage = SQLiteStorage(path)
+    scraper.logger.addHandler(ErrorForwarder(node_id, fetches))
+
+    def record_fetch(storage, chat_id, config_key, config_name, config):
+        cycle = int(time.time() // args.interval)
+        fetches.put((node_id, cycle, chat_id, scraper.search_key(chat_id, config)))
+
+    scraper.process_config = record_fetch
+    scraper.CONFIG_POLL_INTERVAL = args.interval / 10
+    leases = PartitionLeases(storage, partitions=args.partitions, ttl=args.ttl, node_id=node_id)
+    leases.start()
+    threading.Thread(
+        target=scraper.run_forever,
+        args=(storage, ConfigSnapshot(snapshot_path), args.interval, leases),
+        daemon=True,
+    ).start()
+    if crash_after:
+        time.sleep(crash_after)
+        # Exit without releasing anything, as a killed process would
+        os._exit(1)
+    time.sleep(args.seconds)
+    leases.stop()
+
+
+def collect(processes, fetches, storage, args):
+    """Gathers fetch records while editing a config now and then, as bot users would."""
+    records = []
+    edits = 0
+    next_edit = time.time()
+    while any(p.is_alive() for p in processes) or not fetches.empty():
+        if time.time() >= next_edit and any(p.is_alive() for p in processes):
+            chat_id = str(edits % args.chats)
+            storage.save_configurations(chat_id, {"name": f"Search {chat_id}", "search_text": f"edit {edits}"})
+            edits += 1
+            next_edit = time.time() + args.interval / 4
+        try:
+            records.append(fetches.get(timeout=0.5))
+        except queue.Empty:
+            pass
+    return records
+
+
+def snapshot_readable(snapshot_path, storage):
+    try:
+        with open(snapshot_path) as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"shared snapshot unreadable: {e}")
+        return False
+    print(f"shared snapshot at version {data['version']} of {storage.max_config_version()}")
+    return data["storage_id"] == storage.storage_identity()
+
+
+def report(args, records, started, crashed_at):
+    errors = [record for record in records if record[1] is None]
+    records = [record for record in records if record[1] is not None]
+    first_cycle = int(started // args.interval)
+    by_cycle = defaultdict(Counter)
+    chats_by_cycle = defaultdict(set)
+    nodes_by_cycle = defaultdict(set)
+    for node_id, cycle, chat_id, key in records:
+        by_cycle[cycle][key] += 1
+        chats_by_cycle[cycle].add(chat_id)
+        nodes_by_cycle[cycle].add(node_id)
+    for cycle in sorted(by_cycle):
+        print(
+            f"cycle {cycle - first_cycle:3d}: {len(chats_by_cycle[cycle]):4d}/{args.chats} chats  "
+            f"nodes {', '.join(sorted(nodes_by_cycle[cycle]))}"
+        )
+
+    # An edited config is a new search, so duplicates are counted per search
+    duplicates = sum(count - 1 for searches in by_cycle.values() for count in searches.values())
+    # The crashed node's leases expire after at most one TTL, then the
+    # survivors rebalance on their next heartbeat
+    recovered_by = crashed_at + args.ttl * 2 + args.interval
+    late = {chat_id for _, cycle, chat_id, _ in records if cycle * args.interval >= recovered_by}
+    missing = args.chats - len(late)
+    print(f"fetches per node: {dict(Counter(node_id for node_id, _, _, _ in records))}")
+    print(f"duplicate fetches within a cycle: {duplicates}")
+    print(f"chats not fetched after the crash was recovered: {missing}")
+    print(f"errors logged by nodes: {len(errors)}")
+    for node_id, _, _, message in errors[:5]:
+        print(f"  {node_id}: {message}")
+    return duplicates == 0 and missing == 0 and not errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=3)
+    parser.add_argument("--chats", type=int, default=40)
+    parser.add_argument("--partitions", type=int, default=12)
+    parser.add_argument("--interval", type=float, default=2, help="seconds per scrape cycle")
+    parser.add_argument("--ttl", type=float, default=3, help="lease TTL in seconds")
+    parser.add_argument("--seconds", type=float, default=30, help="how long the surviving nodes run")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, "leases.db")
+        snapshot_path = os.path.join(root, "snapshot.json")
+        storage = SQLiteStorage(path)
+        for chat_id in range(args.chats):
+            storage.save_configurations(str(chat_id), {"name": f"Search {chat_id}", "search_text": f"item {chat_id}"})
+
+        fetches = multiprocessing.Queue()
+        crash_after = args.seconds / 3
+        started = time.time()
+        processes = [
+            multiprocessing.Process(
+                target=run_node,
+                args=(path, snapshot_path, f"node{i}", args, crash_after if i == args.nodes - 1 else 0, fetches),
+            )
+            for i in range(args.nodes)
+        ]
+        for process in processes:
+            process.start()
+        records = collect(processes, fetches, storage, args)
+        ok = report(args, records, started, started + crash_after)
+        ok = snapshot_readable(snapshot_path, storage) and ok
+    print("OK" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
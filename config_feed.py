@@ -0,0 +1,96 @@
+import os
+import json
+import logging
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# Local copy of the configs so that each run only pulls what changed
+CONFIG_SNAPSHOT_PATH = os.getenv("CONFIG_SNAPSHOT_PATH", ".config_snapshot.json")
+
+
+def iter_config_entries(chat_config):
+    """Yield (config_key, config_name, config) for every config of a chat.
+
+    A chat may hold several named sub-configs or a single flat config,
+    which is reported under the "default" key.
+    """
+    if isinstance(chat_config, dict) and any(isinstance(v, dict) for v in chat_config.values()):
+        for config_key, sub_config in chat_config.items():
+            yield config_key, sub_config.get("name", f"Unnamed config ({config_key})"), sub_config
+    else:
+        yield "default", chat_config.get("name", "Unnamed config"), chat_config
+
+
+class ConfigSnapshot:
+    """Local snapshot of every chat's config, kept current from the storage change feed."""
+
+    def __init__(self, path=CONFIG_SNAPSHOT_PATH):
+        self.path = path
+        # Identity of the storage the snapshot was built from
+        self.storage_id = None
+        self.version = 0
+        self.configs = {}
+        self.versions = {}
+        self.load()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable config snapshot {self.path}: {e}")
+            return
+        self.storage_id = data.get("storage_id")
+        self.version = data.get("version", 0)
+        self.configs = data.get("configs", {})
+        self.versions = data.get("versions", {})
+
+    def save(self):
+        if not self.path:
+            return
+        # Several scraper processes may share the snapshot path, so each
+        # writes its own temp file and the last rename wins
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=f"{os.path.basename(self.path)}.", suffix=".tmp",
+            dir=os.path.dirname(os.path.abspath(self.path))
+        )
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({
+                    "storage_id": self.storage_id,
+                    "version": self.version,
+                    "configs": self.configs,
+                    "versions": self.versions,
+                }, f)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def refresh(self, storage):
+        """Pull config changes from storage and return the chat_ids that changed."""
+        storage_id = storage.storage_identity()
+        # A different or recreated database has versions unrelated to ours
+        reset = storage_id != self.storage_id or storage.max_config_version() < self.version
+        if reset:
+            if self.configs:
+                logger.warning("Config snapshot does not match storage, reloading every config.")
+            self.storage_id = storage_id
+            self.version = 0
+            self.configs = {}
+            self.versions = {}
+        changes, version = storage.load_configuration_changes(self.version)
+        changed = []
+        for chat_id, change in changes.items():
+            self.configs[chat_id] = change["configs"]
+            self.versions[chat_id] = change["version"]
+            changed.append(chat_id)
+        self.version = max(self.version, version)
+        if changed:
+            logger.info(f"Config snapshot at version {self.version}, {len(changed)} chat(s) changed.")
+        if changed or reset:
+            self.save()
+        return changed
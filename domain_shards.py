@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Defaults for every marketplace domain
+DOMAIN_CONCURRENCY = int(os.getenv("DOMAIN_CONCURRENCY", 1))
+DOMAIN_REQUESTS_PER_MINUTE = float(os.getenv("DOMAIN_REQUESTS_PER_MINUTE", 6))
+# Per-domain overrides, e.g. {"www.vinted.fr": {"concurrency": 2, "requests_per_minute": 10}}
+DOMAIN_LIMITS = json.loads(os.getenv("DOMAIN_LIMITS", "{}"))
+BACKOFF_BASE_SECONDS = 30
+BACKOFF_MAX_SECONDS = 15 * 60
+
+
+class DomainShard:
+    """
+    Work queue for a single marketplace domain.
+    Each shard has its own worker threads, request budget and backoff state,
+    so a throttled domain never delays the others.
+    """
+
+    def __init__(self, domain, handler, concurrency, requests_per_minute, stop_event, skip_backoff=False):
+        self.domain = domain
+        self.handler = handler
+        self.stop_event = stop_event
+        self.cond = threading.Condition()
+        self.queue = deque()
+        self.active = 0
+        # Token bucket refilled at requests_per_minute, holding up to one token per worker
+        self.rate = requests_per_minute / 60.0
+        self.capacity = max(concurrency, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.failures = 0
+        self.backoff_until = 0.0
+        # One-shot runs drop a backed-off domain's work instead of waiting it out
+        self.skip_backoff = skip_backoff
+        self.budget_lock = threading.Lock()
+        self.threads = []
+        # At least one worker, otherwise queued entries would never drain
+        for i in range(self.capacity):
+            thread = threading.Thread(target=self.work, name=f"shard-{domain}-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, entry, priority=False):
+        with self.cond:
+            if priority:
+                self.queue.appendleft(entry)
+            else:
+                self.queue.append(entry)
+            self.cond.notify()
+
+    def discard(self, predicate):
+        """Drop queued entries matching predicate."""
+        with self.cond:
+            self.queue = deque(entry for entry in self.queue if not predicate(entry))
+
+    def is_idle(self):
+        with self.cond:
+            return not self.queue and self.active == 0
+
+    def join(self, deadline=None):
+        """Wait until the queue has drained; False if deadline (monotonic) passed first."""
+        with self.cond:
+            while (self.queue or self.active) and not self.stop_event.is_set():
+                if deadline is not None and time.monotonic() >= deadline:
+                    return False
+                self.cond.wait(1)
+        return True
+
+    def backing_off(self):
+        with self.budget_lock:
+            return time.monotonic() < self.backoff_until
+
+    def wait_for_turn(self):
+        """Block until the backoff has passed and the budget has a token; False if stopping."""
+        while True:
+            with self.budget_lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                wait = self.backoff_until - now
+                if wait <= 0:
+                    # A non-positive budget means the domain is not rate limited
+                    if self.rate <= 0 or self.tokens >= 1:
+                        self.tokens -= 1
+                        return True
+                    wait = (1 - self.tokens) / self.rate
+            if self.stop_event.wait(wait):
+                return False
+
+    def record_success(self):
+        with self.budget_lock:
+            self.failures = 0
+
+    def record_failure(self):
+        with self.budget_lock:
+            self.failures += 1
+            delay = min(BACKOFF_BASE_SECONDS * 2 ** (self.failures - 1), BACKOFF_MAX_SECONDS)
+            self.backoff_until = time.monotonic() + delay
+            failures = self.failures
+        logger.warning(f"Backing off {self.domain} for {delay}s after {failures} failure(s).")
+        if self.skip_backoff:
+            with self.cond:
+                skipped = len(self.queue)
+                self.queue.clear()
+                self.cond.notify_all()
+            logger.warning(f"Skipping {skipped} queued search(es) on {self.domain} until the next run.")
+
+    def work(self):
+        while not self.stop_event.is_set():
+            with self.cond:
+                while not self.queue and not self.stop_event.is_set():
+                    self.cond.wait(1)
+                if self.stop_event.is_set():
+                    return
+                entry = self.queue.popleft()
+                self.active += 1
+            try:
+                # Entries popped by other workers before the queue was dropped
+                if self.skip_backoff and self.backing_off():
+                    continue
+                if not self.wait_for_turn():
+                    return
+                self.handler(entry)
+                self.record_success()
+            except Exception:
+                logger.exception(f"Scrape failed on {self.domain}")
+                self.record_failure()
+            finally:
+                with self.cond:
+                    self.active -= 1
+                    self.cond.notify_all()
+
+
+class ShardScheduler:
+    """Routes work to one DomainShard per domain, created on first use."""
+
+    def __init__(self, handler, skip_backoff=False):
+        self.handler = handler
+        self.skip_backoff = skip_backoff
+        self.stop_event = threading.Event()
+        self.shards = {}
+        self.lock = threading.Lock()
+
+    def shard(self, domain):
+        with self.lock:
+            if domain not in self.shards:
+                limits = DOMAIN_LIMITS.get(domain, {})
+                self.shards[domain] = DomainShard(
+                    domain,
+                    self.handler,
+                    limits.get("concurrency", DOMAIN_CONCURRENCY),
+                    limits.get("requests_per_minute", DOMAIN_REQUESTS_PER_MINUTE),
+                    self.stop_event,
+                    self.skip_backoff,
+                )
+            return self.shards[domain]
+
+    def submit(self, domain, entry, priority=False):
+        self.shard(domain).submit(entry, priority)
+
+    def discard(self, predicate):
+        with self.lock:
+            shards = list(self.shards.values())
+        for shard in shards:
+            shard.discard(predicate)
+
+    def join(self, timeout=None):
+        """Wait until every shard has drained its queue; False if timeout passed first."""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self.lock:
+            shards = list(self.shards.values())
+        return all([shard.join(deadline) for shard in shards])
+
+    def stop(self):
+        self.stop_event.set()
@@ -0,0 +1,112 @@
+import os
+import math
+import uuid
+import socket
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Number of chat partitions shared between scraper instances; 0 disables leasing
+SCRAPER_PARTITIONS = int(os.getenv("SCRAPER_PARTITIONS", 0))
+LEASE_TTL = int(os.getenv("LEASE_TTL", 60))
+# Leases are renewed this many times per TTL so a slow round trip does not lose them
+HEARTBEATS_PER_TTL = 3
+
+NODE_PREFIX = "node:"
+PARTITION_PREFIX = "partition:"
+
+
+def partition_of(chat_id, partitions):
+    """Stable partition number for a chat, identical on every node."""
+    digest = hashlib.sha1(str(chat_id).encode()).digest()
+    return int.from_bytes(digest[:4], "big") % partitions
+
+
+class PartitionLeases:
+    """
+    Shares chat partitions between scraper instances through leases in storage.
+    Every node heartbeats a node lease and holds about an equal share of the
+    partition leases; partitions of a crashed node are picked up once its
+    leases expire.
+    """
+
+    def __init__(self, storage, partitions=SCRAPER_PARTITIONS, ttl=LEASE_TTL, node_id=None):
+        self.storage = storage
+        self.partitions = partitions
+        self.ttl = ttl
+        self.node_id = node_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.owned = set()
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def owned_partitions(self):
+        with self.lock:
+            return set(self.owned)
+
+    def owns(self, chat_id):
+        with self.lock:
+            return partition_of(chat_id, self.partitions) in self.owned
+
+    def rebalance(self):
+        """Renew owned leases, release any above our fair share and take free ones up to it."""
+        self.storage.acquire_lease(NODE_PREFIX + self.node_id, self.node_id, self.ttl)
+        leases = self.storage.list_leases()
+        nodes = {owner for name, (owner, until) in leases.items() if name.startswith(NODE_PREFIX)}
+        nodes.add(self.node_id)
+        share = math.ceil(self.partitions / len(nodes))
+
+        with self.lock:
+            owned = set(self.owned)
+        # Keep what we can renew, lowest partitions first, up to our share
+        kept = set()
+        for partition in sorted(owned):
+            name = f"{PARTITION_PREFIX}{partition}"
+            if len(kept) >= share:
+                self.storage.release_lease(name, self.node_id)
+            elif self.storage.acquire_lease(name, self.node_id, self.ttl):
+                kept.add(partition)
+        for partition in range(self.partitions):
+            if len(kept) >= share:
+                break
+            name = f"{PARTITION_PREFIX}{partition}"
+            holder = leases.get(name)
+            if partition in kept or (holder and holder[0] != self.node_id):
+                continue
+            if self.storage.acquire_lease(name, self.node_id, self.ttl):
+                kept.add(partition)
+
+        with self.lock:
+            lost = self.owned - kept
+            gained = kept - self.owned
+            self.owned = kept
+        if lost or gained:
+            logger.info(
+                f"Node {self.node_id} owns {len(kept)}/{self.partitions} partitions "
+                f"(+{len(gained)} -{len(lost)}, {len(nodes)} node(s))."
+            )
+
+    def heartbeat(self):
+        while not self.stop_event.wait(self.ttl / HEARTBEATS_PER_TTL):
+            try:
+                self.rebalance()
+            except Exception:
+                logger.exception("Lease heartbeat failed")
+
+    def start(self):
+        self.rebalance()
+        self.thread = threading.Thread(target=self.heartbeat, name="lease-heartbeat", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop heartbeating and hand every lease back so other nodes can take over at once."""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+        with self.lock:
+            owned, self.owned = self.owned, set()
+        for partition in owned:
+            self.storage.release_lease(f"{PARTITION_PREFIX}{partition}", self.node_id)
+        self.storage.release_lease(NODE_PREFIX + self.node_id, self.node_id)
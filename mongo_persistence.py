@@ -1,52 +1,333 @@
 import os
-from pymongo import MongoClient
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pymongo import MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
 from dotenv import load_dotenv
 
+from storage import (
+    OUTBOX_RETENTION,
+    RECENT_ITEMS_LIMIT,
+    RECENT_ITEMS_RETENTION,
+    Storage,
+    outbox_event_id,
+    recent_item_rows,
+)
+
 load_dotenv()
 
 MONGODB_URI = os.getenv("MONGODB_URI")
 DATABASE_NAME = os.getenv("DATABASE_NAME", "vinted_scraper")
 CONFIG_COLLECTION = "configs"
+# Holds the global config version counter
+COUNTERS_COLLECTION = "counters"
+# Legacy collection holding one document with a full "ids" list per chat
 IDS_COLLECTION = "known_ids"
+# One document per (chat_id, item_id) pair, covered by a unique index
+SEEN_COLLECTION = "seen_ids"
+# Durable queue of new-item notifications waiting for delivery
+OUTBOX_COLLECTION = "outbox"
+# Work leases held by scraper instances, and the searches fetched per cycle
+LEASES_COLLECTION = "leases"
+FETCH_CLAIMS_COLLECTION = "fetch_claims"
+# Fetch claims only need to outlive the cycle they belong to
+FETCH_CLAIM_RETENTION = 24 * 60 * 60
+# Bounded log of recently scraped listings per chat and config
+RECENT_ITEMS_COLLECTION = "recent_items"
+
+
+class MongoStorage(Storage):
+    def __init__(self, uri=MONGODB_URI, database_name=DATABASE_NAME):
+        self.client = MongoClient(uri)
+        self.db = self.client[database_name]
+        self.db[SEEN_COLLECTION].create_index(
+            [("chat_id", 1), ("item_id", 1)], unique=True
+        )
+        self.db[CONFIG_COLLECTION].create_index("version")
+        self.db[OUTBOX_COLLECTION].create_index([("status", 1), ("available_at", 1)])
+        self.db[OUTBOX_COLLECTION].create_index([("status", 1), ("lease_until", 1)])
+        # Delivered events are removed by Mongo once expire_at passes
+        self.db[OUTBOX_COLLECTION].create_index("expire_at", expireAfterSeconds=0)
+        self.db[FETCH_CLAIMS_COLLECTION].create_index("expire_at", expireAfterSeconds=0)
+        self.db[RECENT_ITEMS_COLLECTION].create_index(
+            [("chat_id", 1), ("config_key", 1), ("seen_at", -1)]
+        )
+        self.db[RECENT_ITEMS_COLLECTION].create_index("expire_at", expireAfterSeconds=0)
+        self.migrated_chats = set()
+        # Never hand out versions below what is stored, even if the counter was reset
+        self.db[COUNTERS_COLLECTION].update_one(
+            {"_id": CONFIG_COLLECTION},
+            {"$max": {"seq": self.max_config_version()}},
+            upsert=True
+        )
+        self.db[COUNTERS_COLLECTION].update_one(
+            {"_id": "storage_id"},
+            {"$setOnInsert": {"value": uuid.uuid4().hex}},
+            upsert=True
+        )
+
+    def load_configurations(self):
+        """Load configurations from MongoDB.
+        The document structure can be:
+        {
+            "_id": "<chat_id>",
+            "configs": { ... }
+        }
+        """
+        collection = self.db[CONFIG_COLLECTION]
+        # For simplicity, return a dict mapping chat_id to configuration
+        configs = {}
+        for doc in collection.find({}):
+            chat_id = doc["_id"]
+            configs[chat_id] = doc.get("configs", {})
+        presets = []  # or load from a different collection
+        return configs, presets
+
+    def load_configuration(self, chat_id):
+        """Load a single chat's configuration by _id."""
+        doc = self.db[CONFIG_COLLECTION].find_one({"_id": chat_id}, {"configs": 1})
+        presets = []
+        return (doc.get("configs", {}) if doc else None), presets
+
+    def next_config_version(self, session=None):
+        counter = self.db[COUNTERS_COLLECTION].find_one_and_update(
+            {"_id": CONFIG_COLLECTION},
+            {"$inc": {"seq": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        return counter["seq"]
+
+    def save_configurations(self, chat_id, config_data):
+        """Upsert the configuration for a given chat_id, bumping its version.
+
+        The counter bump and the write share a transaction, so concurrent saves
+        conflict on the counter and commit in version order. Transactions need a
+        replica set; Atlas clusters always are one.
+        """
+        collection = self.db[CONFIG_COLLECTION]
+
+        def write(session):
+            collection.update_one(
+                {"_id": chat_id},
+                {"$set": {
+                    "configs": config_data,
+                    "version": self.next_config_version(session),
+                    "updated_at": time.time()
+                }},
+                upsert=True,
+                session=session
+            )
+
+        with self.client.start_session() as session:
+            session.with_transaction(write)
+
+    def load_configuration_changes(self, since_version):
+        collection = self.db[CONFIG_COLLECTION]
+        # Documents written before versioning have no version field
+        query = {"version": {"$gt": since_version}} if since_version > 0 else {}
+        changes = {}
+        version = since_version
+        for doc in collection.find(query).sort("version", 1):
+            doc_version = doc.get("version", 0)
+            changes[doc["_id"]] = {
+                "configs": doc.get("configs", {}),
+                "version": doc_version,
+                "updated_at": doc.get("updated_at")
+            }
+            version = max(version, doc_version)
+        return changes, version
+
+    def max_config_version(self):
+        doc = self.db[CONFIG_COLLECTION].find_one(
+            {"version": {"$exists": True}}, {"version": 1}, sort=[("version", -1)]
+        )
+        return doc["version"] if doc else 0
+
+    def storage_identity(self):
+        doc = self.db[COUNTERS_COLLECTION].find_one({"_id": "storage_id"})
+        return f"mongo:{doc['value']}" if doc else None
+
+    def migrate_legacy_ids(self, chat_id):
+        """Move a chat's IDs from the legacy list document into seen_ids (once per process)."""
+        if chat_id in self.migrated_chats:
+            return
+        legacy = self.db[IDS_COLLECTION]
+        doc = legacy.find_one({"_id": chat_id})
+        if doc and doc.get("ids"):
+            self.add_known_ids(chat_id, doc["ids"])
+        if doc:
+            legacy.delete_one({"_id": chat_id})
+        self.migrated_chats.add(chat_id)
+
+    def filter_known_ids(self, chat_id, ids):
+        self.migrate_legacy_ids(chat_id)
+        cursor = self.db[SEEN_COLLECTION].find(
+            {"chat_id": chat_id, "item_id": {"$in": list(ids)}},
+            {"_id": 0, "item_id": 1}
+        )
+        return {doc["item_id"] for doc in cursor}
+
+    def add_known_ids(self, chat_id, ids):
+        operations = [
+            UpdateOne(
+                {"chat_id": chat_id, "item_id": item_id},
+                {"$setOnInsert": {"chat_id": chat_id, "item_id": item_id}},
+                upsert=True
+            )
+            for item_id in ids
+        ]
+        if operations:
+            self.db[SEEN_COLLECTION].bulk_write(operations, ordered=False)
+
+    def enqueue_notifications(self, events):
+        now = time.time()
+        operations = [
+            UpdateOne(
+                {"_id": outbox_event_id(event["chat_id"], event["item_id"])},
+                {"$setOnInsert": {
+                    **event,
+                    "status": "pending",
+                    "attempts": 0,
+                    "available_at": now,
+                    "created_at": now
+                }},
+                upsert=True
+            )
+            for event in events
+        ]
+        if operations:
+            self.db[OUTBOX_COLLECTION].bulk_write(operations, ordered=False)
+
+    def claim_notifications(self, worker_id, limit, lease_seconds):
+        collection = self.db[OUTBOX_COLLECTION]
+        now = time.time()
+        claimed = []
+        # Each claim is a single atomic update, so concurrent workers never share an event
+        while len(claimed) < limit:
+            doc = collection.find_one_and_update(
+                {"$or": [
+                    {"status": "pending", "available_at": {"$lte": now}},
+                    {"status": "claimed", "lease_until": {"$lt": now}}
+                ]},
+                {"$set": {
+                    "status": "claimed",
+                    "claimed_by": worker_id,
+                    "lease_until": now + lease_seconds
+                }},
+                sort=[("created_at", 1)],
+                return_document=ReturnDocument.AFTER
+            )
+            if doc is None:
+                break
+            doc["id"] = doc.pop("_id")
+            claimed.append(doc)
+        return claimed
+
+    def complete_notifications(self, event_ids):
+        if not event_ids:
+            return
+        expire_at = datetime.now(timezone.utc) + timedelta(seconds=OUTBOX_RETENTION)
+        self.db[OUTBOX_COLLECTION].update_many(
+            {"_id": {"$in": list(event_ids)}},
+            {"$set": {"status": "delivered", "delivered_at": time.time(), "expire_at": expire_at}}
+        )
+
+    def fail_notifications(self, event_ids, retry_delay, max_attempts):
+        if not event_ids:
+            return
+        # Pipeline update so the new status can depend on the incremented attempts
+        gives_up = {"$gte": [{"$add": [{"$ifNull": ["$attempts", 0]}, 1]}, max_attempts]}
+        expire_at = datetime.now(timezone.utc) + timedelta(seconds=OUTBOX_RETENTION)
+        self.db[OUTBOX_COLLECTION].update_many(
+            {"_id": {"$in": list(event_ids)}},
+            [{"$set": {
+                "attempts": {"$add": [{"$ifNull": ["$attempts", 0]}, 1]},
+                "available_at": time.time() + retry_delay,
+                "status": {"$cond": [gives_up, "failed", "pending"]},
+                # Given-up events are removed by the TTL index, like delivered ones
+                "expire_at": {"$cond": [gives_up, expire_at, "$$REMOVE"]}
+            }}]
+        )
+
+    def acquire_lease(self, name, owner, ttl):
+        now = time.time()
+        try:
+            # Matches only a free, expired or own lease; otherwise the upsert
+            # collides with the existing _id and the lease stays with its holder
+            self.db[LEASES_COLLECTION].update_one(
+                {"_id": name, "$or": [{"owner": owner}, {"lease_until": {"$lt": now}}]},
+                {"$set": {"owner": owner, "lease_until": now + ttl}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return False
+        return True
+
+    def release_lease(self, name, owner):
+        self.db[LEASES_COLLECTION].delete_one({"_id": name, "owner": owner})
+
+    def list_leases(self):
+        cursor = self.db[LEASES_COLLECTION].find({"lease_until": {"$gte": time.time()}})
+        return {doc["_id"]: (doc["owner"], doc["lease_until"]) for doc in cursor}
+
+    def claim_fetch(self, search_key, cycle):
+        try:
+            self.db[FETCH_CLAIMS_COLLECTION].insert_one({
+                "_id": f"{cycle}:{search_key}",
+                "expire_at": datetime.now(timezone.utc) + timedelta(seconds=FETCH_CLAIM_RETENTION)
+            })
+        except DuplicateKeyError:
+            return False
+        return True
+
+    def record_recent_items(self, chat_id, config_key, items):
+        collection = self.db[RECENT_ITEMS_COLLECTION]
+        expire_at = datetime.now(timezone.utc) + timedelta(seconds=RECENT_ITEMS_RETENTION)
+        operations = [
+            UpdateOne(
+                {"_id": f"{chat_id}:{config_key}:{row['item_id']}"},
+                {"$setOnInsert": {
+                    **row,
+                    "chat_id": chat_id,
+                    "config_key": config_key,
+                    "expire_at": expire_at
+                }},
+                upsert=True
+            )
+            for row in recent_item_rows(items)
+        ]
+        if not operations:
+            return
+        collection.bulk_write(operations, ordered=False)
+        # Keep only the newest RECENT_ITEMS_LIMIT entries; the TTL index handles age
+        boundary = list(
+            collection.find({"chat_id": chat_id, "config_key": config_key}, {"seen_at": 1})
+            .sort("seen_at", -1)
+            .skip(RECENT_ITEMS_LIMIT - 1)
+            .limit(1)
+        )
+        if boundary:
+            collection.delete_many({
+                "chat_id": chat_id,
+                "config_key": config_key,
+                "seen_at": {"$lt": boundary[0]["seen_at"]}
+            })
 
-client = MongoClient(MONGODB_URI)
-db = client[DATABASE_NAME]
-
-def load_configurations():
-    """Load configurations from MongoDB.
-    The document structure can be:
-    {
-        "_id": "<chat_id>",
-        "configs": { ... }
-    }
-    """
-    collection = db[CONFIG_COLLECTION]
-    # For simplicity, return a dict mapping chat_id to configuration
-    configs = {}
-    for doc in collection.find({}):
-        chat_id = doc["_id"]
-        configs[chat_id] = doc.get("configs", {})
-    presets = []  # or load from a different collection
-    return configs, presets
-
-def save_configurations(chat_id, config_data):
-    """Upsert the configuration for a given chat_id."""
-    collection = db[CONFIG_COLLECTION]
-    collection.update_one(
-        {"_id": chat_id},
-        {"$set": {"configs": config_data}},
-        upsert=True
-    )
-
-def load_known_ids(chat_id):
-    collection = db[IDS_COLLECTION]
-    doc = collection.find_one({"_id": chat_id})
-    return set(doc.get("ids", [])) if doc else set()
-
-def save_known_ids(chat_id, new_ids):
-    collection = db[IDS_COLLECTION]
-    collection.update_one(
-        {"_id": chat_id},
-        {"$set": {"ids": list(new_ids)}},
-        upsert=True
-    )
+    def load_recent_items(self, chat_id, config_key, offset, limit):
+        collection = self.db[RECENT_ITEMS_COLLECTION]
+        # The TTL monitor only runs about once a minute
+        query = {
+            "chat_id": chat_id,
+            "config_key": config_key,
+            "seen_at": {"$gte": time.time() - RECENT_ITEMS_RETENTION}
+        }
+        cursor = (
+            collection.find(query, {"_id": 0, "item_id": 1, "title": 1, "url": 1, "seen_at": 1})
+            .sort("seen_at", -1)
+            .skip(offset)
+            .limit(limit)
+        )
+        return list(cursor), collection.count_documents(query)
@@ -0,0 +1,157 @@
+import os
+import time
+import uuid
+import logging
+import threading
+import html
+import requests
+
+# Import the configured persistence backend
+from storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+DELIVERY_WORKERS = int(os.getenv("DELIVERY_WORKERS", 4))
+DELIVERY_BATCH_SIZE = 50
+# A worker that dies mid-delivery releases its events after this long
+DELIVERY_LEASE_SECONDS = 120
+# Retries back off exponentially up to an hour apart, so an event is only
+# given up after about five hours of failures
+MAX_DELIVERY_ATTEMPTS = 12
+RETRY_BASE_DELAY = 30
+RETRY_MAX_DELAY = 60 * 60
+IDLE_POLL_INTERVAL = 2
+MAX_MESSAGE_LENGTH = 4000  # Safe limit
+
+
+class DeliveryError(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# ----- Telegram Notification Functions -----
+def send_telegram_message(message, chat_id):
+    """
+    Sends a Telegram message to a given chat.
+    Splits the message into chunks if needed.
+    Raises DeliveryError if Telegram rejects any chunk.
+    """
+    from config import TELEGRAM_BOT_TOKEN  # Import token from config
+    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+    responses = []
+    for i in range(0, len(message), MAX_MESSAGE_LENGTH):
+        payload = {
+            "chat_id": chat_id,
+            "text": message[i:i+MAX_MESSAGE_LENGTH],
+            "parse_mode": "HTML"
+        }
+        try:
+            response = requests.post(url, data=payload, timeout=30)
+            result = response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise DeliveryError(f"Telegram request failed: {e}")
+        if not result.get("ok"):
+            retry_after = result.get("parameters", {}).get("retry_after")
+            raise DeliveryError(result.get("description", "Telegram error"), retry_after)
+        responses.append(result)
+    return responses
+
+
+def format_notifications(config_name, events):
+    """Build one or more messages listing the events, splitting between items."""
+    header = f"New Vinted products found for <b>{html.escape(str(config_name))}</b>:\n\n"
+    messages = []
+    message = header
+    for event in events:
+        entry = (
+            f"<b>{html.escape(str(event.get('title')))}</b>\n"
+            f"ID: {event['item_id']}\nURL: {html.escape(str(event.get('url')))}\n\n"
+        )
+        if message != header and len(message) + len(entry) > MAX_MESSAGE_LENGTH:
+            messages.append(message)
+            message = header
+        message += entry
+    messages.append(message)
+    return messages
+
+
+def retry_delay(attempts):
+    """Seconds to wait before the next try of an event that failed attempts times so far."""
+    return min(RETRY_BASE_DELAY * 2 ** attempts, RETRY_MAX_DELAY)
+
+
+def deliver_events(storage, events):
+    """Send claimed events, grouped into one notification per chat and config."""
+    groups = {}
+    for event in events:
+        groups.setdefault((event["chat_id"], event.get("config_name")), []).append(event)
+    for (chat_id, config_name), group in groups.items():
+        event_ids = [event["id"] for event in group]
+        try:
+            for message in format_notifications(config_name, group):
+                send_telegram_message(message, chat_id)
+        except DeliveryError as e:
+            attempts = max(event.get("attempts") or 0 for event in group)
+            delay = retry_delay(attempts) if e.retry_after is None else e.retry_after
+            if attempts + 1 >= MAX_DELIVERY_ATTEMPTS:
+                logger.error(
+                    f"Giving up on {len(group)} notification(s) for chat {chat_id} ({config_name}) "
+                    f"after {attempts + 1} attempts: {e}; items {[event['item_id'] for event in group]}"
+                )
+            else:
+                logger.warning(f"Delivery to chat {chat_id} failed, retrying in {delay}s: {e}")
+            storage.fail_notifications(event_ids, delay, MAX_DELIVERY_ATTEMPTS)
+            continue
+        storage.complete_notifications(event_ids)
+        logger.info(f"Sent {len(group)} new products to chat {chat_id} ({config_name}).")
+
+
+def delivery_worker(storage, stop_event, drain_event=None):
+    """
+    Drains the outbox until stop_event is set.
+    If drain_event is set, the worker also exits as soon as the outbox is empty.
+    """
+    worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    while not stop_event.is_set():
+        events = storage.claim_notifications(worker_id, DELIVERY_BATCH_SIZE, DELIVERY_LEASE_SECONDS)
+        if not events:
+            if drain_event is not None and drain_event.is_set():
+                return
+            stop_event.wait(IDLE_POLL_INTERVAL)
+            continue
+        try:
+            deliver_events(storage, events)
+        except Exception:
+            # Leases expire, so unfinished events are picked up again later
+            logger.exception("Delivery worker failed on a batch")
+
+
+def start_delivery_workers(storage, count=DELIVERY_WORKERS, drain_event=None):
+    """Start count delivery threads; returns (threads, stop_event)."""
+    stop_event = threading.Event()
+    threads = []
+    for i in range(count):
+        thread = threading.Thread(
+            target=delivery_worker,
+            args=(storage, stop_event, drain_event),
+            name=f"delivery-{i}",
+            daemon=True,
+        )
+        thread.start()
+        threads.append(thread)
+    return threads, stop_event
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+    )
+    threads, stop_event = start_delivery_workers(get_storage())
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        stop_event.set()
+        for thread in threads:
+            thread.join()
@@ -1,43 +1,91 @@
 import os
 import time
 import logging
+import argparse
 import urllib.parse
-import requests
+import threading
+import hashlib
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.common.exceptions import TimeoutException, WebDriverException
 from webdriver_manager.chrome import ChromeDriverManager
 from bs4 import BeautifulSoup
 
-# Import MongoDB‑based persistence functions
-from mongo_persistence import load_configurations, load_known_ids, save_known_ids
+# Import the configured persistence backend
+from storage import get_storage
+from config_feed import ConfigSnapshot, iter_config_entries
+from notifier import start_delivery_workers
+from domain_shards import ShardScheduler
+from leases import SCRAPER_PARTITIONS, PartitionLeases, partition_of
 from config import DEFAULT_SCRAPER_URL
 
+DEFAULT_DOMAIN = urllib.parse.urlsplit(DEFAULT_SCRAPER_URL).netloc
+
 # ----- Setup Logging -----
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
 )
 logger = logging.getLogger(__name__)
 
-# ----- Telegram Notification Functions -----
-def send_telegram_message(message, chat_id):
-    """
-    Sends a Telegram message to a given chat.
-    Splits the message into chunks if needed.
-    """
-    from config import TELEGRAM_BOT_TOKEN  # Import token from config
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-    max_length = 4000  # Safe limit
-    responses = []
-    for i in range(0, len(message), max_length):
-        payload = {
-            "chat_id": chat_id,
-            "text": message[i:i+max_length],
-            "parse_mode": "HTML"
-        }
-        response = requests.post(url, data=payload)
-        responses.append(response.json())
-    return responses
+# Seconds between full scraping passes in --loop mode
+SCRAPE_INTERVAL = int(os.getenv("SCRAPE_INTERVAL", 300))
+# How often to poll for config changes while idle in --loop mode
+CONFIG_POLL_INTERVAL = 15
+# A one-shot run stops queuing scrapes after this long, so a scheduled job
+# (every 5 minutes in the GitHub workflow) never overlaps the next one
+RUN_ONCE_TIMEOUT = int(os.getenv("RUN_ONCE_TIMEOUT", 180))
+
+# ----- Browser Profile -----
+# The lean profile skips every request the scraper does not need
+LEAN_BROWSER = os.getenv("LEAN_BROWSER", "true").lower() != "false"
+PRODUCT_LINK_SELECTOR = 'a[data-testid$="--overlay-link"]'
+# Shown instead of the grid when a search matches nothing
+EMPTY_CATALOG_SELECTOR = '[data-testid*="empty-state"]'
+# Present on any catalog page, whether or not the search has results
+CATALOG_CONTAINER_SELECTOR = (
+    f'{PRODUCT_LINK_SELECTOR}, {EMPTY_CATALOG_SELECTOR}, [data-testid*="catalog"], .feed-grid'
+)
+# Bot-protection challenges served in place of the catalog
+BLOCK_PAGE_MARKERS = ["captcha-delivery.com", "challenge-platform", "cf-chl-", "px-captcha"]
+# Longest wait for product links to render, then for lazy items after scrolling
+PAGE_LOAD_TIMEOUT = 10
+SCROLL_SETTLE_SECONDS = 5
+USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/114.0.0.0 Safari/537.36"
+)
+BLOCKED_RESOURCE_PATTERNS = [
+    # Images and media
+    "*.jpg*", "*.jpeg*", "*.png*", "*.gif*", "*.webp*", "*.avif*", "*.svg*", "*.ico*",
+    "*.mp4*", "*.webm*", "*.mp3*", "*.m3u8*",
+    # Fonts
+    "*.woff*", "*.woff2*", "*.ttf*", "*.otf*", "*.eot*",
+]
+BLOCKED_THIRD_PARTY_PATTERNS = [
+    "*googletagmanager.com*", "*google-analytics.com*", "*doubleclick.net*",
+    "*googlesyndication.com*", "*adservice.google.*", "*facebook.net*", "*facebook.com/tr*",
+    "*hotjar.com*", "*onetrust.com*", "*cookielaw.org*", "*criteo.*", "*taboola.com*",
+    "*adnxs.com*", "*amazon-adsystem.com*", "*scorecardresearch.com*", "*branch.io*",
+    "*sentry.io*", "*datadoghq.com*", "*nr-data.net*", "*tiktok.com*", "*pinterest.com*",
+]
+LEAN_CHROME_ARGUMENTS = [
+    "--blink-settings=imagesEnabled=false",
+    "--disable-extensions",
+    "--disable-background-networking",
+    "--disable-component-update",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--disable-translate",
+    "--disable-notifications",
+    "--disable-features=Translate,MediaRouter,OptimizationHints,InterestFeedContentSuggestions",
+    "--mute-audio",
+    "--no-first-run",
+]
 
 # ----- URL Building -----
 def build_url(config):
@@ -45,7 +93,7 @@ def build_url(config):
     Builds the URL for Vinted catalog using the configuration.
     List values are encoded with square brackets.
     """
-    domain = config.get("domain", "www.vinted.co.uk")
+    domain = config.get("domain", DEFAULT_DOMAIN)
     base_url = f"https://{domain}/catalog"
     keys_to_skip = {"domain", "name"}
     params = []
@@ -60,44 +108,105 @@ def build_url(config):
     query = urllib.parse.urlencode(params, doseq=True)
     return f"{base_url}?{query}"
 
-def fix_url(href):
+def fix_url(href, domain=DEFAULT_DOMAIN):
     """Prepends domain if URL is relative."""
     if not href.startswith("http"):
-        return "https://www.vinted.co.uk" + href
+        return f"https://{domain}" + href
     return href
 
 # ----- Scraping Function -----
-def scrape_vinted(url):
-    """
-    Uses Selenium to scrape the Vinted page and returns a list of products.
-    Each product is a dict with keys: "id", "title", and "url".
-    """
+class PageNotRendered(Exception):
+    """Raised when a challenge page or something other than a catalog comes back."""
+
+def build_chrome_options(lean=LEAN_BROWSER):
     chrome_options = Options()
     chrome_options.add_argument("--headless")
     chrome_options.add_argument("--disable-gpu")
     chrome_options.add_argument("--no-sandbox")
     chrome_options.add_argument("--window-size=1920,1080")
-    chrome_options.add_argument(
-        "user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-        "AppleWebKit/537.36 (KHTML, like Gecko) "
-        "Chrome/114.0.0.0 Safari/537.36"
-    )
+    chrome_options.add_argument(f"user-agent={USER_AGENT}")
+    if lean:
+        for argument in LEAN_CHROME_ARGUMENTS:
+            chrome_options.add_argument(argument)
+        # Chrome has no content setting for fonts; the URL patterns block them
+        chrome_options.add_experimental_option("prefs", {
+            "profile.managed_default_content_settings.images": 2,
+            "profile.default_content_setting_values.notifications": 2,
+        })
+    return chrome_options
+
+def create_driver(lean=LEAN_BROWSER, extra_blocked_patterns=()):
+    """Starts Chrome; the lean profile blocks images, media, fonts and trackers via DevTools."""
     service = Service(ChromeDriverManager().install())
-    driver = webdriver.Chrome(service=service, options=chrome_options)
+    driver = webdriver.Chrome(service=service, options=build_chrome_options(lean))
+    if lean:
+        blocked = BLOCKED_RESOURCE_PATTERNS + BLOCKED_THIRD_PARTY_PATTERNS + list(extra_blocked_patterns)
+        try:
+            driver.execute_cdp_cmd("Network.enable", {})
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": blocked})
+        except WebDriverException as e:
+            logger.warning(f"Could not enable request blocking: {e}")
+    return driver
+
+def open_catalog_page(driver, url):
+    """
+    Navigates to a catalog page and waits for product links or the empty-results
+    block; False if neither rendered in time.
+    """
     driver.get(url)
-    time.sleep(10)
+    try:
+        WebDriverWait(driver, PAGE_LOAD_TIMEOUT).until(
+            EC.presence_of_element_located(
+                (By.CSS_SELECTOR, f"{PRODUCT_LINK_SELECTOR}, {EMPTY_CATALOG_SELECTOR}")
+            )
+        )
+    except TimeoutException:
+        logger.warning(f"No catalog rendered within {PAGE_LOAD_TIMEOUT}s: {url}")
+        return False
+    return True
+
+def scroll_and_settle(driver):
+    """Scrolls to the bottom and gives lazily loaded items time to render."""
     driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-    time.sleep(5)
-    html = driver.page_source
-    driver.quit()
+    time.sleep(SCROLL_SETTLE_SECONDS)
+
+def load_page_html(driver, url):
+    """Loads a catalog page, scrolls to the bottom and returns the rendered HTML."""
+    open_catalog_page(driver, url)
+    scroll_and_settle(driver)
+    return driver.page_source
+
+def is_blocked_page(soup, html):
+    """True for a challenge page, or a page without any catalog on it."""
+    if soup.select_one(EMPTY_CATALOG_SELECTOR):
+        return False
+    lowered = html.lower()
+    if any(marker in lowered for marker in BLOCK_PAGE_MARKERS):
+        return True
+    return soup.select_one(CATALOG_CONTAINER_SELECTOR) is None
+
+def scrape_vinted(url):
+    """
+    Uses Selenium to scrape the Vinted page and returns a list of products.
+    Each product is a dict with keys: "id", "title", and "url".
+    """
+    domain = urllib.parse.urlsplit(url).netloc or DEFAULT_DOMAIN
+    driver = create_driver()
+    try:
+        html = load_page_html(driver, url)
+    finally:
+        driver.quit()
     
     soup = BeautifulSoup(html, 'html.parser')
-    product_links = soup.select('a[data-testid$="--overlay-link"]')
+    product_links = soup.select(PRODUCT_LINK_SELECTOR)
+    # A search with no results is fine; raising for a block lets the domain shard back off
+    if not product_links and is_blocked_page(soup, html):
+        raise PageNotRendered(f"Blocked or not a catalog page: {url}")
     products = []
     for a_tag in product_links:
         href = a_tag.get("href")
         if href:
-            href = fix_url(href)
+            href = fix_url(href, domain)
             try:
                 parts = href.split("/items/")[1]
                 product_id = parts.split("-")[0]
@@ -115,51 +224,172 @@ def get_new_products(products, known_ids):
     """Return products whose IDs are not in known_ids."""
     return [p for p in products if p["id"] not in known_ids]
 
+def process_config(storage, chat_id, config_key, config_name, config):
+    """
+    Scrape one configuration and queue notifications for unseen products.
+    Delivery happens separately, so a slow Telegram API never stalls scraping.
+    """
+    url = build_url(config)
+    logger.info(f"Scraping URL for chat {chat_id} ({config_name}): {url}")
+    products = scrape_vinted(url)
+    logger.info(f"Found {len(products)} products for chat {chat_id} ({config_name}).")
+    # Every parsed product feeds the recent-listings log served by /latest
+    storage.record_recent_items(chat_id, config_key, products)
+    all_ids = {p["id"] for p in products}
+    known_ids = storage.filter_known_ids(chat_id, all_ids)
+    new_products = get_new_products(products, known_ids)
+    if new_products:
+        # Queue before marking IDs as known; the outbox ignores duplicates,
+        # so a crash in between can only re-queue, never drop, an item
+        storage.enqueue_notifications([
+            {
+                "chat_id": chat_id,
+                "item_id": prod["id"],
+                "config_name": config_name,
+                "title": prod["title"],
+                "url": prod["url"],
+            }
+            for prod in new_products
+        ])
+        logger.info(f"Queued {len(new_products)} new products for chat {chat_id} ({config_name}).")
+    else:
+        logger.info(f"No new products for chat {chat_id} ({config_name}).")
+    # Record every seen ID for this chat
+    storage.add_known_ids(chat_id, all_ids)
+
+def entries_by_domain(chat_configs, leases=None):
+    """
+    Group every (chat_id, config_key, config_name, config) entry by the domain it scrapes.
+    With leases, chats in partitions this node does not own are left out.
+    """
+    domains = {}
+    for chat_id, chat_config in chat_configs.items():
+        if leases is not None and not leases.owns(chat_id):
+            continue
+        for config_key, config_name, config in iter_config_entries(chat_config):
+            domain = config.get("domain", DEFAULT_DOMAIN)
+            domains.setdefault(domain, []).append((chat_id, config_key, config_name, config))
+    return domains
+
+def search_key(chat_id, config):
+    """Identifies one chat's search across every instance."""
+    return hashlib.sha1(f"{chat_id}|{build_url(config)}".encode()).hexdigest()
+
+def process_entry(storage, entry, leases=None, interval=SCRAPE_INTERVAL):
+    """
+    Scrapes one queued entry.
+    When several instances share the work, the entry is skipped if another
+    node already fetched the search this cycle, e.g. before a partition moved.
+    """
+    chat_id, config_key, config_name, config = entry
+    if leases is not None:
+        cycle = int(time.time() // interval)
+        if not storage.claim_fetch(search_key(chat_id, config), cycle):
+            logger.info(f"Skipping chat {chat_id} ({config_name}), already fetched this cycle.")
+            return
+    process_config(storage, chat_id, config_key, config_name, config)
+
+def create_scheduler(storage, leases=None, interval=SCRAPE_INTERVAL, skip_backoff=False):
+    """Each domain gets its own shard, so a throttled marketplace only slows itself."""
+    return ShardScheduler(lambda entry: process_entry(storage, entry, leases, interval), skip_backoff)
+
+def run_once(storage, snapshot, timeout=RUN_ONCE_TIMEOUT):
+    """
+    Scrape every config in the snapshot once.
+    A domain that starts failing is skipped until the next run, and whatever is
+    still queued after timeout seconds is left for the next run as well.
+    """
+    snapshot.refresh(storage)
+    scheduler = create_scheduler(storage, skip_backoff=True)
+    for domain, entries in entries_by_domain(snapshot.configs).items():
+        for entry in entries:
+            scheduler.submit(domain, entry)
+    if not scheduler.join(timeout):
+        logger.warning(f"Stopping after {timeout}s with searches still queued; they run next time.")
+    scheduler.stop()
+
+def run_forever(storage, snapshot, interval, leases=None):
+    """
+    Keeps scraping every config once per interval, tracked separately per domain.
+    The change feed is polled while shards work, and new or edited configs
+    jump to the front of their shard's queue instead of waiting for the next pass.
+    """
+    scheduler = create_scheduler(storage, leases, interval)
+    pass_started = {}
+    owned = leases.owned_partitions() if leases is not None else None
+    while True:
+        try:
+            changed_chats = snapshot.refresh(storage)
+        except Exception:
+            # Keep scraping from the snapshot we have; the next poll retries
+            logger.exception("Could not refresh configs, keeping the current snapshot")
+            changed_chats = []
+        for chat_id in changed_chats:
+            scheduler.discard(lambda entry, chat_id=chat_id: entry[0] == chat_id)
+            changed = entries_by_domain({chat_id: snapshot.configs[chat_id]}, leases)
+            for domain, entries in changed.items():
+                for entry in reversed(entries):
+                    scheduler.submit(domain, entry, priority=True)
+        current = leases.owned_partitions() if leases is not None else None
+        if current != owned:
+            # Drop work for partitions handed to other nodes and queue the chats
+            # we picked up, which their previous owner may not have reached
+            gained, owned = current - owned, current
+            scheduler.discard(lambda entry: not leases.owns(entry[0]))
+            gained_configs = {
+                chat_id: chat_config for chat_id, chat_config in snapshot.configs.items()
+                if partition_of(chat_id, leases.partitions) in gained
+            }
+            for domain, entries in entries_by_domain(gained_configs).items():
+                for entry in entries:
+                    scheduler.submit(domain, entry)
+        now = time.time()
+        for domain, entries in entries_by_domain(snapshot.configs, leases).items():
+            shard = scheduler.shard(domain)
+            started = pass_started.get(domain)
+            if started is not None and now - started < interval:
+                continue
+            # Let a shard finish its previous pass (or a change) before queuing the next
+            if not shard.is_idle():
+                pass_started.setdefault(domain, now)
+                continue
+            pass_started[domain] = now
+            for entry in entries:
+                scheduler.submit(domain, entry)
+        time.sleep(CONFIG_POLL_INTERVAL)
+
 # ----- Main Execution -----
 if __name__ == "__main__":
-    configs, presets = load_configurations()
-    
-    # Iterate over each chat configuration (supports multi-config)
-    for chat_id, chat_config in configs.items():
-        # Load known IDs for this chat
-        known_ids = load_known_ids(chat_id)
-        
-        # Check if the configuration is multi-config (contains sub-configs)
-        if isinstance(chat_config, dict) and any(isinstance(v, dict) for v in chat_config.values()):
-            for config_key, sub_config in chat_config.items():
-                config_name = sub_config.get("name", f"Unnamed config ({config_key})")
-                url = build_url(sub_config)
-                logger.info(f"Scraping URL for chat {chat_id} ({config_name}): {url}")
-                products = scrape_vinted(url)
-                logger.info(f"Found {len(products)} products for chat {chat_id} ({config_name}).")
-                new_products = get_new_products(products, known_ids)
-                if new_products:
-                    message = f"New Vinted products found for <b>{config_name}</b>:\n\n"
-                    for prod in new_products:
-                        message += f"<b>{prod['title']}</b>\nID: {prod['id']}\nURL: {prod['url']}\n\n"
-                    responses = send_telegram_message(message, chat_id)
-                    logger.info(f"Sent Telegram notification to chat {chat_id}: {responses}")
-                else:
-                    logger.info(f"No new products for chat {chat_id} ({config_name}).")
-                all_ids = {p["id"] for p in products}
-                known_ids = known_ids.union(all_ids)
+    parser = argparse.ArgumentParser(description="Scrape Vinted for every saved configuration.")
+    parser.add_argument("--loop", action="store_true", help="keep running instead of scraping once")
+    parser.add_argument("--interval", type=int, default=SCRAPE_INTERVAL, help="seconds between full passes")
+    parser.add_argument("--no-deliver", action="store_true", help="only queue notifications; run notifier.py to send them")
+    args = parser.parse_args()
+
+    # A one-shot node would lease partitions from a node set that is still
+    # forming and exit before the shares settle, leaving chats unscraped
+    if SCRAPER_PARTITIONS and not args.loop:
+        parser.error("SCRAPER_PARTITIONS requires --loop")
+
+    storage = get_storage()
+    snapshot = ConfigSnapshot()
+    # With SCRAPER_PARTITIONS set, several instances split the chats between them
+    leases = PartitionLeases(storage) if SCRAPER_PARTITIONS else None
+    if leases is not None:
+        leases.start()
+    # One-shot runs drain the outbox once scraping is done, then exit
+    drain_event = threading.Event()
+    threads = []
+    if not args.no_deliver:
+        threads, stop_event = start_delivery_workers(storage, drain_event=drain_event)
+    try:
+        if args.loop:
+            run_forever(storage, snapshot, args.interval, leases)
         else:
-            config_name = chat_config.get("name", "Unnamed config")
-            url = build_url(chat_config)
-            logger.info(f"Scraping URL for chat {chat_id} ({config_name}): {url}")
-            products = scrape_vinted(url)
-            logger.info(f"Found {len(products)} products for chat {chat_id} ({config_name}).")
-            new_products = get_new_products(products, known_ids)
-            if new_products:
-                message = f"New Vinted products found for <b>{config_name}</b>:\n\n"
-                for prod in new_products:
-                    message += f"<b>{prod['title']}</b>\nID: {prod['id']}\nURL: {prod['url']}\n\n"
-                responses = send_telegram_message(message, chat_id)
-                logger.info(f"Sent Telegram notification to chat {chat_id}: {responses}")
-            else:
-                logger.info(f"No new products for chat {chat_id}.")
-            all_ids = {p["id"] for p in products}
-            known_ids = known_ids.union(all_ids)
-        
-        # Save updated known IDs for this chat in MongoDB
-        save_known_ids(chat_id, known_ids)
+            run_once(storage, snapshot)
+            drain_event.set()
+            for thread in threads:
+                thread.join()
+    finally:
+        if leases is not None:
+            leases.stop()
@@ -0,0 +1,612 @@
+import os
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Which backend to use: "mongo" (default), "sqlite" or "memory"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "mongo").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "vinted_scraper.db")
+
+# SQLite limits the number of bound parameters per statement
+SQLITE_CHUNK_SIZE = 500
+# Delivered notifications are kept this long so re-enqueued items are ignored
+OUTBOX_RETENTION = 24 * 60 * 60
+# Recent listings kept per chat and config, bounded by count and by age
+RECENT_ITEMS_LIMIT = int(os.getenv("RECENT_ITEMS_LIMIT", 200))
+RECENT_ITEMS_RETENTION = 7 * 24 * 60 * 60
+
+
+class Storage:
+    """Interface shared by all persistence backends.
+
+    Configurations are stored per chat as a dict of sub-configs; seen item
+    IDs are stored per chat so that lookups only touch the IDs being checked.
+    """
+
+    def load_configurations(self):
+        """Return (configs, presets) where configs maps chat_id to its configuration."""
+        raise NotImplementedError
+
+    def load_configuration(self, chat_id):
+        """Return (config, presets) for a single chat; config is None if it has none."""
+        raise NotImplementedError
+
+    def save_configurations(self, chat_id, config_data):
+        """Upsert the configuration for a given chat_id."""
+        raise NotImplementedError
+
+    def load_configuration_changes(self, since_version):
+        """Return (changes, version) for configs saved after since_version.
+
+        changes maps chat_id to {"configs", "version", "updated_at"}; version is the
+        highest version seen, or since_version if nothing changed. Backends must
+        make versions visible in increasing order, so that a reader never sees a
+        version before a lower one that is still being written.
+        """
+        raise NotImplementedError
+
+    def max_config_version(self):
+        """Return the highest config version currently stored (0 if none)."""
+        raise NotImplementedError
+
+    def storage_identity(self):
+        """Return an ID that changes whenever the underlying database is replaced."""
+        raise NotImplementedError
+
+    def filter_known_ids(self, chat_id, ids):
+        """Return the subset of ids that were already seen for chat_id."""
+        raise NotImplementedError
+
+    def add_known_ids(self, chat_id, ids):
+        """Mark ids as seen for chat_id."""
+        raise NotImplementedError
+
+    def enqueue_notifications(self, events):
+        """Add new-item events to the outbox.
+
+        Each event is a dict with chat_id, item_id, config_name, title and url.
+        Events already in the outbox for the same (chat_id, item_id) are ignored.
+        """
+        raise NotImplementedError
+
+    def claim_notifications(self, worker_id, limit, lease_seconds):
+        """Lease up to limit pending events to worker_id and return them.
+
+        Events whose lease expired without completion are handed out again.
+        """
+        raise NotImplementedError
+
+    def complete_notifications(self, event_ids):
+        """Mark events as delivered."""
+        raise NotImplementedError
+
+    def fail_notifications(self, event_ids, retry_delay, max_attempts):
+        """Return events to the queue after retry_delay, or give up after max_attempts.
+
+        Given-up events are kept for OUTBOX_RETENTION, like delivered ones, then removed.
+        """
+        raise NotImplementedError
+
+    def acquire_lease(self, name, owner, ttl):
+        """Take or renew the lease called name for owner; False if someone else holds it."""
+        raise NotImplementedError
+
+    def release_lease(self, name, owner):
+        """Give up a lease, if owner still holds it."""
+        raise NotImplementedError
+
+    def list_leases(self):
+        """Return {name: (owner, lease_until)} for every unexpired lease."""
+        raise NotImplementedError
+
+    def claim_fetch(self, search_key, cycle):
+        """Record that search_key is fetched in cycle; False if it already was."""
+        raise NotImplementedError
+
+    def record_recent_items(self, chat_id, config_key, items):
+        """Append scraped items (dicts with id, title and url) to the recent-listings log.
+
+        Items already in the log keep their first-seen time; the log is trimmed
+        to RECENT_ITEMS_LIMIT entries and RECENT_ITEMS_RETENTION seconds.
+        """
+        raise NotImplementedError
+
+    def load_recent_items(self, chat_id, config_key, offset, limit):
+        """Return (items, total) for the recent-listings log, newest first."""
+        raise NotImplementedError
+
+
+def outbox_event_id(chat_id, item_id):
+    return f"{chat_id}:{item_id}"
+
+
+def recent_item_rows(items):
+    """Give items increasing seen_at values, so the first item on the page sorts newest."""
+    now = time.time()
+    count = len(items)
+    return [
+        {
+            "item_id": str(item["id"]),
+            "title": item.get("title"),
+            "url": item.get("url"),
+            "seen_at": now + (count - position) * 1e-6,
+        }
+        for position, item in enumerate(items)
+    ]
+
+
+class MemoryStorage(Storage):
+    """Process-local storage, useful for tests and dry runs."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.identity = f"memory:{uuid.uuid4().hex}"
+        self.configs = {}
+        self.config_versions = {}
+        self.version = 0
+        self.known_ids = {}
+        self.outbox = {}
+        self.leases = {}
+        self.fetch_claims = set()
+        self.recent_items = {}
+
+    def load_configurations(self):
+        with self.lock:
+            configs = json.loads(json.dumps(self.configs))
+        presets = []
+        return configs, presets
+
+    def load_configuration(self, chat_id):
+        with self.lock:
+            config = self.configs.get(chat_id)
+            config = json.loads(json.dumps(config)) if config is not None else None
+        presets = []
+        return config, presets
+
+    def save_configurations(self, chat_id, config_data):
+        with self.lock:
+            self.version += 1
+            self.configs[chat_id] = json.loads(json.dumps(config_data))
+            self.config_versions[chat_id] = (self.version, time.time())
+
+    def load_configuration_changes(self, since_version):
+        changes = {}
+        version = since_version
+        with self.lock:
+            for chat_id, (config_version, updated_at) in self.config_versions.items():
+                if config_version > since_version:
+                    changes[chat_id] = {
+                        "configs": json.loads(json.dumps(self.configs[chat_id])),
+                        "version": config_version,
+                        "updated_at": updated_at,
+                    }
+                    version = max(version, config_version)
+        return changes, version
+
+    def max_config_version(self):
+        with self.lock:
+            return self.version
+
+    def storage_identity(self):
+        return self.identity
+
+    def filter_known_ids(self, chat_id, ids):
+        with self.lock:
+            seen = self.known_ids.get(chat_id, set())
+            return {i for i in ids if i in seen}
+
+    def add_known_ids(self, chat_id, ids):
+        with self.lock:
+            self.known_ids.setdefault(chat_id, set()).update(ids)
+
+    def enqueue_notifications(self, events):
+        now = time.time()
+        with self.lock:
+            for event in events:
+                event_id = outbox_event_id(event["chat_id"], event["item_id"])
+                if event_id in self.outbox:
+                    continue
+                self.outbox[event_id] = {
+                    **event,
+                    "id": event_id,
+                    "status": "pending",
+                    "attempts": 0,
+                    "available_at": now,
+                    "lease_until": None,
+                    "claimed_by": None,
+                    "created_at": now,
+                    "delivered_at": None,
+                }
+
+    def claim_notifications(self, worker_id, limit, lease_seconds):
+        now = time.time()
+        claimed = []
+        with self.lock:
+            for event in self.outbox.values():
+                if len(claimed) >= limit:
+                    break
+                pending = event["status"] == "pending" and event["available_at"] <= now
+                expired = event["status"] == "claimed" and event["lease_until"] < now
+                if pending or expired:
+                    event.update(status="claimed", claimed_by=worker_id, lease_until=now + lease_seconds)
+                    claimed.append(dict(event))
+        return claimed
+
+    def complete_notifications(self, event_ids):
+        now = time.time()
+        with self.lock:
+            for event_id in event_ids:
+                if event_id in self.outbox:
+                    self.outbox[event_id].update(status="delivered", delivered_at=now)
+            self.purge_outbox(now)
+
+    def fail_notifications(self, event_ids, retry_delay, max_attempts):
+        now = time.time()
+        with self.lock:
+            for event_id in event_ids:
+                event = self.outbox.get(event_id)
+                if event is None:
+                    continue
+                event["attempts"] += 1
+                event["status"] = "failed" if event["attempts"] >= max_attempts else "pending"
+                event["available_at"] = now + retry_delay
+            self.purge_outbox(now)
+
+    def purge_outbox(self, now):
+        """Drop delivered and given-up events older than OUTBOX_RETENTION; call with the lock held."""
+        cutoff = now - OUTBOX_RETENTION
+        expired = [
+            event_id for event_id, event in self.outbox.items()
+            if (event["status"] == "delivered" and event["delivered_at"] < cutoff)
+            or (event["status"] == "failed" and event["available_at"] < cutoff)
+        ]
+        for event_id in expired:
+            del self.outbox[event_id]
+
+    def acquire_lease(self, name, owner, ttl):
+        now = time.time()
+        with self.lock:
+            current = self.leases.get(name)
+            if current and current[0] != owner and current[1] >= now:
+                return False
+            self.leases[name] = (owner, now + ttl)
+            return True
+
+    def release_lease(self, name, owner):
+        with self.lock:
+            if self.leases.get(name, (None,))[0] == owner:
+                del self.leases[name]
+
+    def list_leases(self):
+        now = time.time()
+        with self.lock:
+            return {name: lease for name, lease in self.leases.items() if lease[1] >= now}
+
+    def claim_fetch(self, search_key, cycle):
+        with self.lock:
+            if (search_key, cycle) in self.fetch_claims:
+                return False
+            # Only the current and previous cycles matter
+            self.fetch_claims = {claim for claim in self.fetch_claims if claim[1] >= cycle - 1}
+            self.fetch_claims.add((search_key, cycle))
+            return True
+
+    def record_recent_items(self, chat_id, config_key, items):
+        cutoff = time.time() - RECENT_ITEMS_RETENTION
+        with self.lock:
+            log = self.recent_items.setdefault((chat_id, config_key), {})
+            for row in recent_item_rows(items):
+                log.setdefault(row["item_id"], row)
+            newest = sorted(log.values(), key=lambda row: row["seen_at"], reverse=True)
+            kept = [row for row in newest[:RECENT_ITEMS_LIMIT] if row["seen_at"] >= cutoff]
+            self.recent_items[(chat_id, config_key)] = {row["item_id"]: row for row in kept}
+
+    def load_recent_items(self, chat_id, config_key, offset, limit):
+        cutoff = time.time() - RECENT_ITEMS_RETENTION
+        with self.lock:
+            log = self.recent_items.get((chat_id, config_key), {})
+            newest = sorted(
+                (row for row in log.values() if row["seen_at"] >= cutoff),
+                key=lambda row: row["seen_at"], reverse=True
+            )
+        return [dict(row) for row in newest[offset:offset + limit]], len(newest)
+
+
+class SQLiteStorage(Storage):
+    """Local single-node storage backed by an SQLite file in WAL mode."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS configs (
+            chat_id TEXT PRIMARY KEY,
+            configs TEXT NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0,
+            updated_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS configs_version ON configs (version);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS known_ids (
+            chat_id TEXT NOT NULL,
+            item_id TEXT NOT NULL,
+            PRIMARY KEY (chat_id, item_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS outbox (
+            id TEXT PRIMARY KEY,
+            chat_id TEXT NOT NULL,
+            item_id TEXT NOT NULL,
+            config_name TEXT,
+            title TEXT,
+            url TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            available_at REAL NOT NULL,
+            lease_until REAL,
+            claimed_by TEXT,
+            created_at REAL NOT NULL,
+            delivered_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS outbox_status ON outbox (status, available_at);
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            lease_until REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS fetch_claims (
+            search_key TEXT NOT NULL,
+            cycle INTEGER NOT NULL,
+            PRIMARY KEY (search_key, cycle)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS fetch_claims_cycle ON fetch_claims (cycle);
+        CREATE TABLE IF NOT EXISTS recent_items (
+            chat_id TEXT NOT NULL,
+            config_key TEXT NOT NULL,
+            item_id TEXT NOT NULL,
+            title TEXT,
+            url TEXT,
+            seen_at REAL NOT NULL,
+            PRIMARY KEY (chat_id, config_key, item_id)
+        );
+        CREATE INDEX IF NOT EXISTS recent_items_seen ON recent_items (chat_id, config_key, seen_at);
+    """
+
+    OUTBOX_FIELDS = ("id", "chat_id", "item_id", "config_name", "title", "url", "attempts")
+
+    def __init__(self, path=SQLITE_PATH):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.executescript(self.SCHEMA)
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO meta (key, value) VALUES ('storage_id', ?)",
+                (uuid.uuid4().hex,),
+            )
+        self.identity = "sqlite:" + self.conn.execute(
+            "SELECT value FROM meta WHERE key = 'storage_id'"
+        ).fetchone()[0]
+
+    def load_configurations(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT chat_id, configs FROM configs").fetchall()
+        configs = {chat_id: json.loads(data) for chat_id, data in rows}
+        presets = []
+        return configs, presets
+
+    def load_configuration(self, chat_id):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT configs FROM configs WHERE chat_id = ?", (chat_id,)
+            ).fetchone()
+        presets = []
+        return (json.loads(row[0]) if row else None), presets
+
+    def save_configurations(self, chat_id, config_data):
+        with self.lock, self.conn:
+            # Take the write lock up front so concurrent writers get distinct versions
+            self.conn.execute("BEGIN IMMEDIATE")
+            version = self.conn.execute(
+                "SELECT COALESCE(MAX(version), 0) + 1 FROM configs"
+            ).fetchone()[0]
+            self.conn.execute(
+                "INSERT INTO configs (chat_id, configs, version, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(chat_id) DO UPDATE SET configs = excluded.configs, "
+                "version = excluded.version, updated_at = excluded.updated_at",
+                (chat_id, json.dumps(config_data), version, time.time()),
+            )
+
+    def load_configuration_changes(self, since_version):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT chat_id, configs, version, updated_at FROM configs "
+                "WHERE version > ? ORDER BY version",
+                (since_version,),
+            ).fetchall()
+        changes = {
+            chat_id: {"configs": json.loads(data), "version": version, "updated_at": updated_at}
+            for chat_id, data, version, updated_at in rows
+        }
+        version = max([since_version] + [row[2] for row in rows])
+        return changes, version
+
+    def max_config_version(self):
+        with self.lock:
+            return self.conn.execute("SELECT COALESCE(MAX(version), 0) FROM configs").fetchone()[0]
+
+    def storage_identity(self):
+        return self.identity
+
+    def filter_known_ids(self, chat_id, ids):
+        ids = [str(i) for i in ids]
+        found = set()
+        with self.lock:
+            for start in range(0, len(ids), SQLITE_CHUNK_SIZE):
+                chunk = ids[start:start + SQLITE_CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.conn.execute(
+                    f"SELECT item_id FROM known_ids WHERE chat_id = ? AND item_id IN ({placeholders})",
+                    [chat_id, *chunk],
+                ).fetchall()
+                found.update(row[0] for row in rows)
+        return found
+
+    def add_known_ids(self, chat_id, ids):
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO known_ids (chat_id, item_id) VALUES (?, ?)",
+                [(chat_id, str(i)) for i in ids],
+            )
+
+    def enqueue_notifications(self, events):
+        now = time.time()
+        rows = [
+            (
+                outbox_event_id(e["chat_id"], e["item_id"]), e["chat_id"], str(e["item_id"]),
+                e.get("config_name"), e.get("title"), e.get("url"), now, now,
+            )
+            for e in events
+        ]
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO outbox "
+                "(id, chat_id, item_id, config_name, title, url, available_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def claim_notifications(self, worker_id, limit, lease_seconds):
+        now = time.time()
+        with self.lock, self.conn:
+            # Serialize claims across processes sharing the database file
+            self.conn.execute("BEGIN IMMEDIATE")
+            rows = self.conn.execute(
+                f"SELECT {', '.join(self.OUTBOX_FIELDS)} FROM outbox "
+                "WHERE (status = 'pending' AND available_at <= ?) "
+                "OR (status = 'claimed' AND lease_until < ?) "
+                "ORDER BY created_at LIMIT ?",
+                (now, now, limit),
+            ).fetchall()
+            self.conn.executemany(
+                "UPDATE outbox SET status = 'claimed', claimed_by = ?, lease_until = ? WHERE id = ?",
+                [(worker_id, now + lease_seconds, row[0]) for row in rows],
+            )
+        return [dict(zip(self.OUTBOX_FIELDS, row)) for row in rows]
+
+    def complete_notifications(self, event_ids):
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "UPDATE outbox SET status = 'delivered', delivered_at = ? WHERE id = ?",
+                [(now, event_id) for event_id in event_ids],
+            )
+            self.purge_outbox(now)
+
+    def fail_notifications(self, event_ids, retry_delay, max_attempts):
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "UPDATE outbox SET attempts = attempts + 1, available_at = ?, "
+                "status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END "
+                "WHERE id = ?",
+                [(now + retry_delay, max_attempts, event_id) for event_id in event_ids],
+            )
+            self.purge_outbox(now)
+
+    def purge_outbox(self, now):
+        """Drop delivered and given-up events older than OUTBOX_RETENTION; call inside a transaction."""
+        cutoff = now - OUTBOX_RETENTION
+        self.conn.execute(
+            "DELETE FROM outbox WHERE (status = 'delivered' AND delivered_at < ?) "
+            "OR (status = 'failed' AND available_at < ?)",
+            (cutoff, cutoff),
+        )
+
+    def acquire_lease(self, name, owner, ttl):
+        now = time.time()
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO leases (name, owner, lease_until) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, lease_until = excluded.lease_until "
+                "WHERE leases.owner = excluded.owner OR leases.lease_until < ?",
+                (name, owner, now + ttl, now),
+            )
+            return cursor.rowcount == 1
+
+    def release_lease(self, name, owner):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+    def list_leases(self):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT name, owner, lease_until FROM leases WHERE lease_until >= ?",
+                (time.time(),),
+            ).fetchall()
+        return {name: (owner, lease_until) for name, owner, lease_until in rows}
+
+    def claim_fetch(self, search_key, cycle):
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                "INSERT OR IGNORE INTO fetch_claims (search_key, cycle) VALUES (?, ?)",
+                (search_key, cycle),
+            )
+            # Only the current and previous cycles matter
+            self.conn.execute("DELETE FROM fetch_claims WHERE cycle < ?", (cycle - 1,))
+            return cursor.rowcount == 1
+
+    def record_recent_items(self, chat_id, config_key, items):
+        rows = recent_item_rows(items)
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO recent_items (chat_id, config_key, item_id, title, url, seen_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(chat_id, config_key, r["item_id"], r["title"], r["url"], r["seen_at"]) for r in rows],
+            )
+            # Drop entries past the age limit, then everything beyond the newest RECENT_ITEMS_LIMIT
+            self.conn.execute(
+                "DELETE FROM recent_items WHERE chat_id = ? AND config_key = ? AND ("
+                "seen_at < ? OR seen_at < (SELECT seen_at FROM recent_items "
+                "WHERE chat_id = ? AND config_key = ? ORDER BY seen_at DESC LIMIT 1 OFFSET ?))",
+                (chat_id, config_key, time.time() - RECENT_ITEMS_RETENTION,
+                 chat_id, config_key, RECENT_ITEMS_LIMIT - 1),
+            )
+
+    def load_recent_items(self, chat_id, config_key, offset, limit):
+        # Trimming only happens on writes, so a config that stopped being
+        # scraped keeps its old rows; leave those out here
+        cutoff = time.time() - RECENT_ITEMS_RETENTION
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT item_id, title, url, seen_at FROM recent_items "
+                "WHERE chat_id = ? AND config_key = ? AND seen_at >= ? "
+                "ORDER BY seen_at DESC LIMIT ? OFFSET ?",
+                (chat_id, config_key, cutoff, limit, offset),
+            ).fetchall()
+            total = self.conn.execute(
+                "SELECT COUNT(*) FROM recent_items WHERE chat_id = ? AND config_key = ? AND seen_at >= ?",
+                (chat_id, config_key, cutoff),
+            ).fetchone()[0]
+        items = [dict(zip(("item_id", "title", "url", "seen_at"), row)) for row in rows]
+        return items, total
+
+
+def get_storage(backend=None):
+    """Create the storage backend selected by STORAGE_BACKEND."""
+    backend = (backend or STORAGE_BACKEND).lower()
+    if backend == "memory":
+        return MemoryStorage()
+    if backend == "sqlite":
+        return SQLiteStorage()
+    if backend == "mongo":
+        # Imported lazily so local backends work without pymongo installed
+        from mongo_persistence import MongoStorage
+        return MongoStorage()
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
@@ -1,6 +1,10 @@
 import os
 import json
+import asyncio
 import logging
+import functools
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from keep_alive import keep_alive
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.error import BadRequest
@@ -10,8 +14,8 @@ from telegram.ext import (
     CallbackQueryHandler,
     ContextTypes,
 )
-# Import MongoDB‑based persistence functions
-from mongo_persistence import load_configurations, save_configurations
+# Import the configured persistence backend
+from storage import get_storage
 from config import BRANDS, COLORS, STATUSES, PRICE_FROM, CURRENCIES, SIZE_MEN, SIZE_WOMEN
 
 # ----- Setup Logging -----
@@ -20,6 +24,43 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+storage = get_storage()
+
+# Storage calls are blocking, so they run on these threads instead of the event loop
+STORAGE_THREADS = int(os.getenv("STORAGE_THREADS", 8))
+storage_executor = ThreadPoolExecutor(max_workers=STORAGE_THREADS, thread_name_prefix="storage")
+# Updates from different chats are handled concurrently, up to this many at once
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", 64))
+# Listings shown per page of /latest
+LATEST_PAGE_SIZE = 10
+
+# ----- Non-blocking Persistence -----
+async def run_storage(func, *args):
+    """Runs a blocking storage call on the storage executor."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(storage_executor, functools.partial(func, *args))
+
+# One lock per chat keeps that chat's updates in order while other chats run concurrently
+chat_locks = weakref.WeakValueDictionary()
+
+def get_chat_lock(chat_id):
+    lock = chat_locks.get(chat_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        chat_locks[chat_id] = lock
+    return lock
+
+def serialized_per_chat(handler):
+    """Wraps a handler so updates from the same chat are processed one at a time."""
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        chat = update.effective_chat
+        if chat is None:
+            return await handler(update, context)
+        async with get_chat_lock(chat.id):
+            return await handler(update, context)
+    return wrapper
+
 # ----- Helper Functions for Safe Editing -----
 async def safe_edit_message_text(query, text, reply_markup=None):
     try:
@@ -136,6 +177,33 @@ def build_size_women_keyboard(selected_sizes):
     keyboard.append([InlineKeyboardButton("Back to Dashboard", callback_data="dashboard")])
     return InlineKeyboardMarkup(keyboard)
 
+def build_latest_keyboard(config_key, page, pages):
+    # The config key travels with the button, so paging an older message
+    # stays on its config after the user selects another one
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("« Newer", callback_data=f"latest_{config_key}_{page - 1}"))
+    if page < pages - 1:
+        buttons.append(InlineKeyboardButton("Older »", callback_data=f"latest_{config_key}_{page + 1}"))
+    return InlineKeyboardMarkup([buttons]) if buttons else None
+
+async def build_latest_page(chat_id, config_key, page):
+    """Reads one page of recent listings from storage; never triggers a scrape."""
+    page = max(page, 0)
+    items, total = await run_storage(
+        storage.load_recent_items, chat_id, config_key, page * LATEST_PAGE_SIZE, LATEST_PAGE_SIZE
+    )
+    if total == 0:
+        return f"No recent listings for '{config_key}' yet. They appear after the next scrape.", None
+    pages = (total + LATEST_PAGE_SIZE - 1) // LATEST_PAGE_SIZE
+    if not items:
+        # Requested page is past the end; show the last one instead
+        return await build_latest_page(chat_id, config_key, pages - 1)
+    text = f"Latest listings for '{config_key}' (page {page + 1} of {pages}):\n\n"
+    for item in items:
+        text += f"{item.get('title')}\n{item.get('url')}\n\n"
+    return text, build_latest_keyboard(config_key, page, pages)
+
 def get_config_summary(config):
     brand_ids = config.get("brand_ids", [])
     brand_names = [name for name, bid in BRANDS.items() if bid in brand_ids]
@@ -162,16 +230,16 @@ def get_config_summary(config):
 # ----- Command Handlers -----
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = str(update.effective_chat.id)
-    configs, presets = load_configurations()
-    if chat_id not in configs:
+    chat_configs, presets = await run_storage(storage.load_configuration, chat_id)
+    if chat_configs is None:
         if len(presets) >= 2:
-            configs[chat_id] = {"men": presets[0], "women": presets[1]}
+            chat_configs = {"men": presets[0], "women": presets[1]}
         elif presets:
             # If only one preset exists, you might duplicate it for both
-            configs[chat_id] = {"men": presets[0], "women": presets[0]}
+            chat_configs = {"men": presets[0], "women": presets[0]}
         else:
             # Fallback: create empty configs for both men and women
-            configs[chat_id] = {
+            chat_configs = {
                 "men": {
                     "name": "Men's Config",
                     "catalog": [1231],
@@ -203,60 +271,91 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             }
         
         # Save the newly created configuration for this chat
-        save_configurations(chat_id, configs[chat_id])
+        await run_storage(storage.save_configurations, chat_id, chat_configs)
     
     await update.message.reply_text(
         "You are registered for configuration notifications.\n"
-        "Use /selectconfig to switch between your saved configurations."
+        "Use /selectconfig to switch between your saved configurations.\n"
+        "Use /latest to see recently found listings."
     )
 
 async def select_config(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = str(update.effective_chat.id)
-    configs, presets = load_configurations()
-    if chat_id not in configs:
+    chat_configs, presets = await run_storage(storage.load_configuration, chat_id)
+    if chat_configs is None:
         await update.message.reply_text("No configurations found. Use /start to register.")
         return
     # List the keys from your chat configuration.
-    reply_markup = build_config_keyboard(configs[chat_id])
+    reply_markup = build_config_keyboard(chat_configs)
     await update.message.reply_text("Select one of your configurations:", reply_markup=reply_markup)
 
 async def config_dashboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = str(update.effective_chat.id)
-    configs, presets = load_configurations()
-    if chat_id not in configs:
+    chat_configs, presets = await run_storage(storage.load_configuration, chat_id)
+    if chat_configs is None:
         if len(presets) >= 2:
-            configs[chat_id] = {"men": presets[0], "women": presets[1]}
+            chat_configs = {"men": presets[0], "women": presets[1]}
         elif presets:
-            configs[chat_id] = {"default": presets[0]}
-        save_configurations(chat_id, configs[chat_id])
+            chat_configs = {"default": presets[0]}
+        else:
+            await update.message.reply_text("No configurations found. Use /start to register.")
+            return
+        await run_storage(storage.save_configurations, chat_id, chat_configs)
     
     config_key = context.user_data.get("config_key", None)
-    if config_key is None or config_key not in configs[chat_id]:
-        config_key = "men" if "men" in configs[chat_id] else next(iter(configs[chat_id].keys()))
+    if config_key is None or config_key not in chat_configs:
+        config_key = "men" if "men" in chat_configs else next(iter(chat_configs.keys()))
         context.user_data["config_key"] = config_key
-    config = configs[chat_id][config_key]
+    config = chat_configs[config_key]
     text = get_config_summary(config)
     reply_markup = build_dashboard_keyboard(config)
     await update.message.reply_text(text, reply_markup=reply_markup)
 
+async def latest(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = str(update.effective_chat.id)
+    config_key = context.user_data.get("config_key", "men")
+    page = 0
+    if context.args:
+        try:
+            page = int(context.args[0]) - 1
+        except ValueError:
+            await update.message.reply_text("Usage: /latest [page]")
+            return
+    text, reply_markup = await build_latest_page(chat_id, config_key, page)
+    await update.message.reply_text(text, reply_markup=reply_markup, disable_web_page_preview=True)
+
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     data = query.data
     chat_id = str(update.effective_chat.id)
-    configs, presets = load_configurations()
+
+    # --- Recent Listings Paging (served from storage, no config load needed) ---
+    if data.startswith("latest_"):
+        # Config keys may contain underscores, the page number never does
+        try:
+            config_key, page = data[len("latest_"):].rsplit("_", 1)
+            page = int(page)
+        except ValueError:
+            await safe_edit_message_text(query, "Error parsing page number.")
+            return
+        text, reply_markup = await build_latest_page(chat_id, config_key, page)
+        await safe_edit_message_text(query, text, reply_markup)
+        return
+
+    chat_configs, presets = await run_storage(storage.load_configuration, chat_id)
     config_key = context.user_data.get("config_key", "men")
-    if chat_id not in configs or config_key not in configs[chat_id]:
+    if chat_configs is None or config_key not in chat_configs:
         await safe_edit_message_text(query, "No configuration found. Use /start to register.")
         return
-    config = configs[chat_id][config_key]
+    config = chat_configs[config_key]
     
     # --- Handle Configuration Selection from /selectconfig ---
     if data.startswith("select_"):
         new_key = data.split("_", 1)[1]
-        if new_key in configs[chat_id]:
+        if new_key in chat_configs:
             context.user_data["config_key"] = new_key
-            await safe_edit_message_text(query, f"Switched to configuration '{configs[chat_id][new_key].get('name', new_key)}'. Use /dashboard to view/edit.")
+            await safe_edit_message_text(query, f"Switched to configuration '{chat_configs[new_key].get('name', new_key)}'. Use /dashboard to view/edit.")
         else:
             await safe_edit_message_text(query, "Selected configuration not found.")
         return
@@ -267,9 +366,9 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if preset_idx < len(presets):
             preset = presets[preset_idx]
             key = "men" if "Men" in preset.get("name", "") else ("women" if "Women" in preset.get("name", "") else f"preset_{preset_idx}")
-            configs[chat_id][key] = preset
+            chat_configs[key] = preset
             context.user_data["config_key"] = key
-            save_configurations(chat_id, configs[chat_id])
+            await run_storage(storage.save_configurations, chat_id, chat_configs)
             await safe_edit_message_text(query, f"Preset '{preset.get('name')}' assigned to key '{key}'. Use /dashboard to view/edit.")
         else:
             await safe_edit_message_text(query, "Invalid preset selection.")
@@ -284,7 +383,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # --- Save Configuration ---
     if data == "save_config":
-        save_configurations(chat_id, configs[chat_id])
+        await run_storage(storage.save_configurations, chat_id, chat_configs)
         await safe_edit_message_text(query, "Configuration saved.\n" + get_config_summary(config))
         return
 
@@ -344,7 +443,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     if data == "brand_confirm":
         config["brand_ids"] = list(context.user_data.get("brand_ids", set()))
-        save_configurations(chat_id, configs[chat_id])
+        await run_storage(storage.save_configurations, chat_id, chat_configs)
         await safe_edit_message_text(
             query,
             "Brands updated.\n" + get_config_summary(config),
@@ -365,7 +464,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     if data == "color_confirm":
         config["color_ids"] = list(context.user_data.get("color_ids", set()))
-        save_configurations(chat_id, configs[chat_id])
+        await run_storage(storage.save_configurations, chat_id, chat_configs)
         await safe_edit_message_text(
             query,
             "Colors updated.\n" + get_config_summary(config),
@@ -386,7 +485,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     if data == "status_confirm":
         config["status_ids"] = list(context.user_data.get("status_ids", set()))
-        save_configurations(chat_id, configs[chat_id])
+        await run_storage(storage.save_configurations, chat_id, chat_configs)
         await safe_edit_message_text(
             query,
             "Statuses updated.\n" + get_config_summary(config),
@@ -401,7 +500,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     elif data == "price_confirm":
         config["price_from"] = context.user_data.get("price_from", None)
-        save_configurations(chat_id, configs[chat_id])
+        await run_storage(storage.save_configurations, chat_id, chat_configs)
         await safe_edit_message_text(
             query,
             "Minimum price updated.\n" + get_config_summary(config),
@@ -421,7 +520,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if data == "price_to_confirm":
         config["price_to"] = context.user_data.get("price_to", None)
-        save_configurations(chat_id, configs[chat_id])
+        await run_storage(storage.save_configurations, chat_id, chat_configs)
         await safe_edit_message_text(
             query,
             "Maximum price updated.\n" + get_config_summary(config),
@@ -447,7 +546,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     if data == "currency_confirm":
         config["currency"] = context.user_data.get("currency", None)
-        save_configurations(chat_id, configs[chat_id])
+        await run_storage(storage.save_configurations, chat_id, chat_configs)
         await safe_edit_message_text(
             query,
             "Currency updated.\n" + get_config_summary(config),
@@ -468,7 +567,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     if data == "sizemen_confirm":
         config["size_ids_men"] = list(context.user_data.get("size_ids_men", set()))
-        save_configurations(chat_id, configs[chat_id])
+        await run_storage(storage.save_configurations, chat_id, chat_configs)
         await safe_edit_message_text(
             query,
             "Men's sizes updated.\n" + get_config_summary(config),
@@ -489,7 +588,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     if data == "sizewomen_confirm":
         config["size_ids_women"] = list(context.user_data.get("size_ids_women", set()))
-        save_configurations(chat_id, configs[chat_id])
+        await run_storage(storage.save_configurations, chat_id, chat_configs)
         await safe_edit_message_text(
             query,
             "Women's sizes updated.\n" + get_config_summary(config),
@@ -500,14 +599,23 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Fallback response:
     await safe_edit_message_text(query, "Unknown selection.")
 
+def build_application(token, request=None):
+    builder = Application.builder().token(token).concurrent_updates(CONCURRENT_UPDATES)
+    if request is not None:
+        # Lets benchmarks swap in a fake Bot API
+        builder = builder.request(request).get_updates_request(request)
+    application = builder.build()
+
+    application.add_handler(CommandHandler("start", serialized_per_chat(start)))
+    application.add_handler(CommandHandler("selectconfig", serialized_per_chat(select_config)))
+    application.add_handler(CommandHandler("dashboard", serialized_per_chat(config_dashboard)))
+    application.add_handler(CommandHandler("latest", serialized_per_chat(latest)))
+    application.add_handler(CallbackQueryHandler(serialized_per_chat(button_handler)))
+    return application
+
 def main():
     from config import TELEGRAM_BOT_TOKEN
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
-
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("selectconfig", select_config))
-    application.add_handler(CommandHandler("dashboard", config_dashboard))
-    application.add_handler(CallbackQueryHandler(button_handler))
+    application = build_application(TELEGRAM_BOT_TOKEN)
     
     application.run_polling()
 